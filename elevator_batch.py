@@ -0,0 +1,375 @@
+""" Steps many single-car buildings at once, their state held in NumPy arrays
+
+BatchEngine runs the rules of elevator_system for one car per building: Building.next_stop,
+should_elevator_stop_at, direction_served_at, serve_floor and notify_elevator_ready, each as
+array operations over every building with something due at the same moment. Time jumps
+from one due press, arrival, door close or departure to the next, as VirtualClock does,
+and within a moment presses come first, as they do when scheduled before the run.
+
+Presses are scripted per building as (time, kind, floor), kind one of "up", "down" (hall
+buttons) or "car", at whole seconds. There are no passengers, so nobody boards and nothing
+is pressed that wasn't scripted.
+
+check_conformance runs the same random scripts through Building and compares the events
+each car records with what the batch engine logs:
+
+    python elevator_batch.py --check 500
+    python elevator_batch.py --compare 2000     # timings, object model against batch
+
+NumPy is only needed here, so it isn't in requirements.txt with the app's dependencies:
+`pip install -r requirements-elevator.txt` first.
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy
+
+from elevator_system import Building, Doors, Elevator, Trace, VirtualClock
+
+# directions, in the order of Trace.DIRECTIONS
+STATIONARY, UP, DOWN = 0, 1, 2
+# presses; UP and DOWN are hall presses
+CAR = 3
+PRESS_KINDS = {"up": UP, "down": DOWN, "car": CAR}
+# the one call each car can have waiting on the clock
+NO_EVENT, ARRIVE, CLOSE, MOVE = 0, 1, 2, 3
+NEVER = numpy.iinfo(numpy.int64).max
+
+# what a car does rather than what's done to it, those are what BatchEngine logs
+CAR_EVENTS = (Trace.DEPART, Trace.PLAN, Trace.ARRIVE, Trace.DOORS_OPEN, Trace.DOORS_CLOSE, Trace.IDLE, Trace.STUCK)
+
+
+class BatchEngine:
+    def __init__(self, building_count, floor_count, record=False):
+        self.count = building_count
+        self.floor_count = floor_count
+        self.numbers = numpy.arange(1, floor_count + 1)
+        self.now = 0
+
+        self.position = numpy.ones(building_count, dtype=numpy.int64)  # Elevator.stopped_at
+        self.state = numpy.zeros(building_count, dtype=numpy.int8)  # Elevator.current_move_state
+        self.last = numpy.zeros(building_count, dtype=numpy.int8)  # Elevator.last_move_state
+        self.trip_start = numpy.zeros(building_count, dtype=numpy.int64)
+        self.trip_started_at = numpy.zeros(building_count, dtype=numpy.int64)
+        self.target = numpy.zeros(building_count, dtype=numpy.int64)  # 0 when not on a trip
+        self.doors_open = numpy.zeros(building_count, dtype=bool)
+        self.event = numpy.zeros(building_count, dtype=numpy.int8)
+        self.event_time = numpy.full(building_count, NEVER, dtype=numpy.int64)
+
+        # one car, so its calls and the floors' flags are the same thing: column (number - 1) per floor
+        self.up = numpy.zeros((building_count, floor_count), dtype=bool)
+        self.down = numpy.zeros((building_count, floor_count), dtype=bool)
+        self.car = numpy.zeros((building_count, floor_count), dtype=bool)
+
+        self.press_time = numpy.full((building_count, 1), NEVER, dtype=numpy.int64)
+        self.press_kind = numpy.zeros((building_count, 1), dtype=numpy.int8)
+        self.press_floor = numpy.ones((building_count, 1), dtype=numpy.int64)
+        self.press_next = numpy.zeros(building_count, dtype=numpy.int64)
+
+        # per building, (time, kind, floor, direction, value) as Building.record would give them
+        self.logs = [[] for i in range(building_count)] if record else None
+
+    def load(self, scripts):
+        """ One list of (time, kind, floor) presses per building, run in time order, ties in list order """
+        width = max(len(script) for script in scripts) + 1  # a NEVER on the end of every row
+        self.press_time = numpy.full((self.count, width), NEVER, dtype=numpy.int64)
+        self.press_kind = numpy.zeros((self.count, width), dtype=numpy.int8)
+        self.press_floor = numpy.ones((self.count, width), dtype=numpy.int64)
+        for row, script in enumerate(scripts):
+            for column, (when, kind, floor) in enumerate(sorted(script, key=lambda press: press[0])):
+                self.press_time[row, column] = when
+                self.press_kind[row, column] = PRESS_KINDS[kind]
+                self.press_floor[row, column] = floor
+        self.press_next = numpy.zeros(self.count, dtype=numpy.int64)
+
+    def log(self, kind, rows, floors, directions=None, values=None):
+        if self.logs is None:
+            return
+        for i, row in enumerate(rows):
+            direction = Trace.DIRECTIONS[directions[i]] if directions is not None else None
+            self.logs[row].append((self.now, kind, int(floors[i]), direction, int(values[i]) if values is not None else 0))
+
+    def run(self, until=None):
+        """ Until nothing is left to do, or the next thing is after `until` """
+        rows = numpy.arange(self.count)
+        while True:
+            next_press = self.press_time[rows, self.press_next].min()
+            now = min(next_press, self.event_time.min())
+            if now == NEVER or (until is not None and now > until):
+                break
+            self.now = int(now)
+
+            while True:
+                due = numpy.nonzero(self.press_time[rows, self.press_next] == now)[0]
+                if not len(due):
+                    break
+                column = self.press_next[due]
+                self.press(due, self.press_kind[due, column], self.press_floor[due, column])
+                self.press_next[due] = column + 1
+
+            while True:
+                due = numpy.nonzero(self.event_time == now)[0]
+                if not len(due):
+                    break
+                event = self.event[due]
+                self.event[due] = NO_EVENT
+                self.event_time[due] = NEVER
+                self.arrive(due[event == ARRIVE])
+                self.close(due[event == CLOSE])
+                self.do_move(due[event == MOVE])
+
+    def wanted(self, rows):
+        return self.up[rows] | self.down[rows] | self.car[rows]
+
+    def approaching(self, rows):
+        """ Elevator.current_floor for cars on a trip """
+        passed = (self.now - self.trip_started_at[rows]) // Elevator.SECONDS_PER_FLOOR
+        start, target = self.trip_start[rows], self.target[rows]
+        return numpy.where(target > start, numpy.minimum(start + passed + 1, target),
+                           numpy.maximum(start - passed - 1, target))
+
+    def press(self, rows, kind, floors):
+        columns = floors - 1
+        self.up[rows[kind == UP], columns[kind == UP]] = True
+        self.down[rows[kind == DOWN], columns[kind == DOWN]] = True
+        self.car[rows[kind == CAR], columns[kind == CAR]] = True
+
+        # Elevator.notify_calls_changed
+        moving = self.target[rows] != 0
+        if moving.any():
+            self.plan(rows[moving], self.state[rows[moving]], self.approaching(rows[moving]))
+        self.send(rows, floors, numpy.where(kind == CAR, STATIONARY, kind).astype(numpy.int8))
+
+    def send(self, rows, floors, directions):
+        stationary = self.state[rows] == STATIONARY
+        here = stationary & (self.position[rows] == floors)
+        hall = here & (directions != STATIONARY)
+        self.last[rows[hall]] = directions[hall]
+        self.serve(rows[here], floors[here], directions[here])
+
+        movable = stationary & ~here & ~self.doors_open[rows]
+        self.move(rows[movable], numpy.where(self.position[rows[movable]] < floors[movable], UP, DOWN))
+
+    def move(self, rows, directions):
+        self.state[rows] = directions
+        self.event[rows] = MOVE
+        self.event_time[rows] = self.now
+
+    def do_move(self, rows):
+        if not len(rows):
+            return
+        directions = self.state[rows]
+        self.trip_start[rows] = self.position[rows]
+        self.trip_started_at[rows] = self.now
+        self.target[rows] = 0
+        self.log(Trace.DEPART, rows, self.position[rows], directions)
+        self.plan(rows, directions, self.position[rows] + numpy.where(directions == UP, 1, -1))
+
+    def next_stop(self, rows, directions, approaching):
+        """ Building.next_stop """
+        wanted = self.wanted(rows)
+        any_wanted = wanted.any(axis=1)
+        highest = numpy.where(any_wanted, self.floor_count - numpy.argmax(wanted[:, ::-1], axis=1), 0)
+
+        up_stops = (self.car[rows] | self.up[rows]) & (self.numbers >= approaching[:, None])
+        # a down call stops a car going up only when nothing above it wants the car
+        top_down = numpy.nonzero(any_wanted & (highest >= approaching)
+                                 & self.down[rows, numpy.maximum(highest, 1) - 1])[0]
+        up_stops[top_down, highest[top_down] - 1] = True
+        up_target = numpy.where(up_stops.any(axis=1), numpy.argmax(up_stops, axis=1) + 1, self.floor_count)
+
+        down_stops = (self.car[rows] | self.down[rows]) & (self.numbers <= approaching[:, None])
+        down_target = numpy.where(down_stops.any(axis=1),
+                                  self.floor_count - numpy.argmax(down_stops[:, ::-1], axis=1), 1)
+        return numpy.where(directions == UP, up_target, down_target)
+
+    def plan(self, rows, directions, approaching):
+        target = self.next_stop(rows, directions, approaching)
+        changed = target != self.target[rows]
+        rows, directions, approaching, target = rows[changed], directions[changed], approaching[changed], target[changed]
+
+        self.target[rows] = target
+        self.log(Trace.PLAN, rows, approaching, directions, target)
+        arrival = self.trip_started_at[rows] + numpy.abs(target - self.trip_start[rows]) * Elevator.SECONDS_PER_FLOOR
+        self.event[rows] = ARRIVE
+        self.event_time[rows] = numpy.maximum(arrival, self.now)
+
+    def should_stop(self, rows, floors, directions):
+        """ Building.should_elevator_stop_at """
+        columns = floors - 1
+        wanted = self.wanted(rows)
+        anything_above = (wanted & (self.numbers > floors[:, None])).any(axis=1)
+        up, down = self.up[rows, columns], self.down[rows, columns]
+        going_up, going_down = directions == UP, directions == DOWN
+        return (going_down & (floors == 1)) | (wanted[numpy.arange(len(rows)), columns] & (
+            self.car[rows, columns] | (up & going_up) | (down & going_up & ~anything_above) | (down & going_down)))
+
+    def arrive(self, rows):
+        if not len(rows):
+            return
+        directions = self.state[rows]
+        floors = self.target[rows]
+        self.position[rows] = floors
+        self.target[rows] = 0
+
+        stopping = self.should_stop(rows, floors, directions)
+        stuck = ~stopping & (((directions == UP) & (floors == self.floor_count)) | ((directions == DOWN) & (floors == 1)))
+        self.log(Trace.STUCK, rows[stuck], floors[stuck], directions[stuck])
+        self.stop(rows[stopping | stuck])
+        self.do_move(rows[~stopping & ~stuck])
+
+    def direction_served_at(self, rows, floors, directions):
+        columns = floors - 1
+        wanted = self.wanted(rows)
+        above = (wanted & (self.numbers > floors[:, None])).any(axis=1)
+        below = (wanted & (self.numbers < floors[:, None])).any(axis=1)
+        up, down = self.up[rows, columns], self.down[rows, columns]
+        leaving_up = numpy.where(up | above, UP, numpy.where(down, DOWN, UP))
+        leaving_down = numpy.where(down | below, DOWN, numpy.where(up, UP, DOWN))
+        return numpy.where(directions == UP, leaving_up,
+                           numpy.where(directions == DOWN, leaving_down, directions)).astype(numpy.int8)
+
+    def stop(self, rows):
+        if not len(rows):
+            return
+        directions = self.state[rows]
+        floors = self.position[rows]
+        self.log(Trace.ARRIVE, rows, floors, directions)
+        self.last[rows] = self.direction_served_at(rows, floors, directions)
+        self.state[rows] = STATIONARY
+
+        served = self.serve(rows, floors, self.last[rows])
+        self.ready(rows[~served])
+
+    def serve(self, rows, floors, directions):
+        """ Building.serve_floor, without passengers; which of the cars opened their doors """
+        columns = floors - 1
+        hall = ((directions == UP) & self.up[rows, columns]) | ((directions == DOWN) & self.down[rows, columns])
+        served = self.car[rows, columns] | hall
+        rows, columns, directions = rows[served], columns[served], directions[served]
+
+        # opening again while already open restarts the wait
+        self.doors_open[rows] = True
+        self.event[rows] = CLOSE
+        self.event_time[rows] = self.now + Doors.WAIT_TIME_IN_SECONDS
+        self.log(Trace.DOORS_OPEN, rows, columns + 1, directions)
+        self.car[rows, columns] = False
+        self.up[rows[directions == UP], columns[directions == UP]] = False
+        self.down[rows[directions == DOWN], columns[directions == DOWN]] = False
+        return served
+
+    def close(self, rows):
+        self.doors_open[rows] = False
+        self.log(Trace.DOORS_CLOSE, rows, self.position[rows])
+        self.ready(rows)
+
+    def ready(self, rows):
+        """ Building.notify_elevator_ready """
+        if not len(rows):
+            return
+        floors = self.position[rows]
+        wanted = self.wanted(rows)
+        higher = (wanted & (self.numbers > floors[:, None])).any(axis=1)
+        lower = (wanted & (self.numbers < floors[:, None])).any(axis=1)
+        last = self.last[rows]
+        directions = numpy.select(
+            [(last == UP) & higher, (last == UP) & lower, (last == DOWN) & lower, (last == DOWN) & higher,
+             higher, floors > 1],
+            [UP, DOWN, DOWN, UP, UP, DOWN], STATIONARY)
+
+        idle = directions == STATIONARY
+        self.log(Trace.IDLE, rows[idle], floors[idle])
+        self.move(rows[~idle], directions[~idle])
+
+
+def random_script(floor_count, presses, seconds, generator):
+    script = []
+    for i in range(presses):
+        when = generator.randrange(seconds)
+        kind = generator.choice(("up", "down", "car"))
+        if kind == "up":
+            floor = generator.randint(1, floor_count - 1)
+        elif kind == "down":
+            floor = generator.randint(2, floor_count)
+        else:
+            floor = generator.randint(1, floor_count)
+        script.append((when, kind, floor))
+    return script
+
+
+def run_building(floor_count, script):
+    """ The same presses through Building, and the car events it records """
+    trace = Trace(capacity=None)
+    building = Building(floor_count, clock=VirtualClock(), trace=trace)
+    for when, kind, floor in sorted(script, key=lambda press: press[0]):
+        if kind == "car":
+            button = building.elevator.floor_buttons[floor - 1]
+        elif kind == "up":
+            button = building.floors[floor - 1].console.up_button
+        else:
+            button = building.floors[floor - 1].console.down_button
+        building.clock.call_later(when, button.press)
+    building.clock.run()
+    return [(record.time, record.kind, record.floor, record.direction, record.value)
+            for record in trace.records if record.kind in CAR_EVENTS]
+
+
+def check_conformance(building_count=200, floor_count=12, presses=30, seconds=600, seed=0):
+    """ Runs random scripts through Building and BatchEngine, returns the buildings whose events differ """
+    generator = random.Random(seed)
+    scripts = [random_script(floor_count, generator.randint(1, presses), seconds, generator)
+               for i in range(building_count)]
+    engine = BatchEngine(building_count, floor_count, record=True)
+    engine.load(scripts)
+    engine.run()
+
+    mismatches = []
+    for row, script in enumerate(scripts):
+        expected = run_building(floor_count, script)
+        if engine.logs[row] != expected:
+            mismatches.append((row, script, expected, engine.logs[row]))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", type=int, metavar="BUILDINGS", help="compare BUILDINGS random scripts with Building")
+    parser.add_argument("--compare", type=int, metavar="BUILDINGS", help="time BUILDINGS buildings both ways")
+    parser.add_argument("--floors", type=int, default=12)
+    parser.add_argument("--presses", type=int, default=30, help="at most this many presses per building")
+    parser.add_argument("--seconds", type=int, default=600, help="presses fall in the first this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check_conformance(args.check, args.floors, args.presses, args.seconds, args.seed)
+        for row, script, expected, got in mismatches[:3]:
+            print("building %d: %r" % (row, script))
+            for i, (a, b) in enumerate(zip(expected + [None] * len(got), got + [None] * len(expected))):
+                if a != b:
+                    print("  event %d: Building %r, batch %r" % (i, a, b))
+                    break
+        print("%d of %d buildings match" % (args.check - len(mismatches), args.check))
+        sys.exit(1 if mismatches else 0)
+
+    if args.compare:
+        generator = random.Random(args.seed)
+        scripts = [random_script(args.floors, args.presses, args.seconds, generator) for i in range(args.compare)]
+
+        started = time.perf_counter()
+        for script in scripts:
+            run_building(args.floors, script)
+        objects = time.perf_counter() - started
+
+        started = time.perf_counter()
+        engine = BatchEngine(args.compare, args.floors)
+        engine.load(scripts)
+        engine.run()
+        batch = time.perf_counter() - started
+        print("%d buildings: Building %.2f s, BatchEngine %.2f s (%.1fx)" % (args.compare, objects, batch, objects / batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+""" Benchmarks for elevator_system: how the cost of running a building grows with floors and call rate
+
+Every case builds a Building in simulated time, schedules a seeded press workload over
+--seconds and runs until the cars are idle again. Each case runs three times on the same
+presses: plain for events per second, with notify_elevator_ready and
+should_elevator_stop_at timed for dispatch-decision latency, and under tracemalloc for peak
+memory, so no measurement skews the others. --profile adds a fourth run under cProfile.
+
+    python elevator_bench.py                                  # 10 to 10,000 floors, JSON on stdout
+    python elevator_bench.py --floors 100 1000 --rate 600 --compact --output bench.json
+    python elevator_bench.py --baseline bench.json            # events/s against an earlier run
+    python elevator_bench.py --floors 10000 --profile /tmp/elevator-profiles
+
+Workloads:
+    hall        random hall buttons
+    car         random car buttons
+    passengers  people with an origin and destination, boarding and pressing as they ride
+"""
+import argparse
+import cProfile
+import json
+import os
+import platform
+import random
+import threading
+import time
+import tracemalloc
+
+from elevator_system import Building, Elevator, VirtualClock
+
+WORKLOADS = ('hall', 'car', 'passengers')
+
+
+def workload(kind, floor_count, elevator_count, presses_per_minute, seconds, seed):
+    """ (time, what, floor, direction or car) presses, Poisson in time """
+    generator = random.Random(seed)
+    presses = []
+    when = generator.expovariate(presses_per_minute / 60.0)
+    while when < seconds:
+        if kind == 'hall':
+            floor = generator.randint(1, floor_count)
+            if floor == 1:
+                direction = Elevator.UP
+            elif floor == floor_count:
+                direction = Elevator.DOWN
+            else:
+                direction = generator.choice((Elevator.UP, Elevator.DOWN))
+            presses.append((when, 'hall', floor, direction))
+        elif kind == 'car':
+            presses.append((when, 'car', generator.randint(1, floor_count), generator.randrange(elevator_count)))
+        else:
+            origin, destination = generator.sample(range(1, floor_count + 1), 2)
+            presses.append((when, 'passenger', origin, destination))
+        when = when + generator.expovariate(presses_per_minute / 60.0)
+    return presses
+
+
+def build(case):
+    building = Building(case['floors'], clock=VirtualClock(), elevator_count=case['cars'], compact=case['compact'])
+    for when, what, floor, other in case['presses']:
+        if what == 'hall':
+            console = building.floors[floor - 1].console
+            button = console.up_button if other == Elevator.UP else console.down_button
+            building.clock.call_later(when, button.press)
+        elif what == 'car':
+            building.clock.call_later(when, building.elevators[other].floor_buttons[floor - 1].press)
+        else:
+            building.clock.call_later(when, building.add_passenger, floor, other)
+    return building
+
+
+def timed(method, samples, threads):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter_ns()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter_ns() - started)
+            threads[0] = max(threads[0], threading.active_count())
+    return wrapper
+
+
+def latency_summary(samples):
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_us': sum(samples) / len(samples) / 1000,
+        'p50_us': samples[len(samples) // 2] / 1000,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000,
+        'max_us': samples[-1] / 1000,
+    }
+
+
+def run_case(case, profile_dir=None):
+    # plain: events per second
+    started = time.perf_counter()
+    building = build(case)
+    built = time.perf_counter() - started
+    started = time.perf_counter()
+    events = building.clock.run()
+    elapsed = time.perf_counter() - started
+
+    # timed: dispatch decisions, wrapped on the instance so every caller goes through them
+    building = build(case)
+    ready, stop_at, threads = [], [], [threading.active_count()]
+    building.notify_elevator_ready = timed(building.notify_elevator_ready, ready, threads)
+    building.should_elevator_stop_at = timed(building.should_elevator_stop_at, stop_at, threads)
+    building.clock.run()
+
+    # traced: peak memory, building included
+    tracemalloc.start()
+    building = build(case)
+    building.clock.run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    if profile_dir:
+        building = build(case)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        building.clock.run()
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, '%s.prof' % case['name']))
+
+    return {
+        'name': case['name'],
+        'workload': case['workload'],
+        'floors': case['floors'],
+        'cars': case['cars'],
+        'presses_per_minute': case['rate'],
+        'compact': case['compact'],
+        'presses': len(case['presses']),
+        'delivered': len(building.delivered),
+        'simulated_seconds': building.clock.now(),
+        'build_seconds': built,
+        'run_seconds': elapsed,
+        'events': events,
+        'events_per_second': events / elapsed if elapsed else None,
+        'notify_elevator_ready': latency_summary(ready),
+        'should_elevator_stop_at': latency_summary(stop_at),
+        'threads_peak': threads[0],
+        'peak_memory_bytes': peak,
+    }
+
+
+def compare(results, baseline_path):
+    """ Lines of events/s change per case against an earlier run's JSON """
+    with open(baseline_path) as f:
+        baseline = {case['name']: case for case in json.load(f)['results']}
+    lines = []
+    for case in results:
+        before = baseline.get(case['name'])
+        if before and before['events_per_second'] and case['events_per_second']:
+            change = case['events_per_second'] / before['events_per_second'] - 1
+            lines.append('%-40s %12.0f -> %12.0f events/s  %+6.1f%%'
+                         % (case['name'], before['events_per_second'], case['events_per_second'], change * 100))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--floors', type=int, nargs='*', default=[10, 100, 1000, 10000])
+    parser.add_argument('--cars', type=int, nargs='*', default=[1, 4])
+    parser.add_argument('--rate', type=float, nargs='*', default=[6, 60], help="presses per minute")
+    parser.add_argument('--workloads', nargs='*', default=list(WORKLOADS), choices=WORKLOADS)
+    parser.add_argument('--seconds', type=float, default=600, help="simulated seconds of presses per case")
+    parser.add_argument('--compact', action='store_true', help="also run every case with Building(compact=True)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profile', metavar='DIR', help="write a cProfile .prof per case here, for pstats or snakeviz")
+    parser.add_argument('--baseline', help="compare events/s with this earlier JSON output")
+    parser.add_argument('--output', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for kind in args.workloads:
+        for floors in args.floors:
+            for cars in args.cars:
+                for rate in args.rate:
+                    presses = workload(kind, floors, cars, rate, args.seconds, args.seed)
+                    for compact in ([False, True] if args.compact else [False]):
+                        name = '%s-%dfloors-%dcars-%gpm%s' % (kind, floors, cars, rate, '-compact' if compact else '')
+                        case = {'name': name, 'workload': kind, 'floors': floors, 'cars': cars, 'rate': rate,
+                                'compact': compact, 'presses': presses}
+                        results.append(run_case(case, args.profile))
+
+    document = {
+        'config': {
+            'seconds': args.seconds,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    output = json.dumps(document, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    if args.baseline:
+        print('\n'.join(compare(results, args.baseline)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+""" Rebuilds a Building's state over time from a trace saved by elevator_system.Trace.
+
+    python elevator_system.py --virtual --trace run.jsonl
+    python elevator_replay.py run.jsonl
+    python elevator_replay.py run.bin --every 60
+
+Prints one line per event (or per --every seconds of simulated time) with where each car is,
+which way it's going or whether its doors are open, its car calls and riders, and the hall
+calls still waiting.
+"""
+import argparse
+
+from elevator_system import Elevator, Trace
+
+
+class CarState:
+    def __init__(self):
+        self.floor = 1
+        self.direction = None
+        self.target = None
+        self.doors_open = False
+        self.car_calls = set()
+        self.riders = 0
+
+    def describe(self):
+        if self.doors_open:
+            where = str(self.floor) + " open"
+        elif self.direction:
+            where = str(self.floor) + (" ^" if self.direction == Elevator.UP else " v") + str(self.target or "")
+        else:
+            where = str(self.floor)
+        calls = ",".join(str(f) for f in sorted(self.car_calls))
+        return "[" + where + (" calls " + calls if calls else "") + " riders " + str(self.riders) + "]"
+
+
+class BuildingState:
+    def __init__(self):
+        self.cars = {}
+        self.up_calls = set()
+        self.down_calls = set()
+        self.delivered = 0
+
+    def car(self, number):
+        if number not in self.cars:
+            self.cars[number] = CarState()
+        return self.cars[number]
+
+    def apply(self, record):
+        if record.kind == Trace.PRESS_HALL:
+            (self.up_calls if record.direction == Elevator.UP else self.down_calls).add(record.floor)
+            return
+        if record.elevator < 0:
+            return
+
+        car = self.car(record.elevator)
+        if record.kind == Trace.PRESS_CAR:
+            car.car_calls.add(record.floor)
+        elif record.kind == Trace.DEPART:
+            car.floor = record.floor
+            car.direction = record.direction
+            car.doors_open = False
+        elif record.kind == Trace.PLAN:
+            car.target = record.value
+        elif record.kind in (Trace.ARRIVE, Trace.STUCK):
+            car.floor = record.floor
+            car.direction = None
+            car.target = None
+        elif record.kind == Trace.DOORS_OPEN:
+            car.floor = record.floor
+            car.doors_open = True
+            car.car_calls.discard(record.floor)
+            if record.direction == Elevator.UP:
+                self.up_calls.discard(record.floor)
+            elif record.direction == Elevator.DOWN:
+                self.down_calls.discard(record.floor)
+        elif record.kind == Trace.DOORS_CLOSE:
+            car.doors_open = False
+        elif record.kind == Trace.BOARD:
+            car.riders = car.riders + 1
+        elif record.kind == Trace.ALIGHT:
+            car.riders = car.riders - 1
+            self.delivered = self.delivered + 1
+
+    def describe(self):
+        cars = " ".join(self.cars[number].describe() for number in sorted(self.cars))
+        return cars + " up " + str(sorted(self.up_calls)) + " down " + str(sorted(self.down_calls)) \
+            + " delivered " + str(self.delivered)
+
+
+def replay(records):
+    """ Yields (record, state) after each record is applied; the state is updated in place """
+    state = BuildingState()
+    for record in records:
+        state.apply(record)
+        yield record, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', help="a .jsonl or binary trace")
+    parser.add_argument('--every', type=float, help="print a snapshot every so many simulated seconds instead")
+    args = parser.parse_args()
+
+    if args.every is None:
+        for record, state in replay(Trace.load(args.trace)):
+            print(Trace.format(record) + "    " + state.describe())
+        return
+
+    # a snapshot at t shows every record up to and including t, so it's printed before the first one after it
+    state = BuildingState()
+    next_snapshot = last_snapshot = last_time = None
+    for record in Trace.load(args.trace):
+        if next_snapshot is None:
+            next_snapshot = record.time
+        while record.time > next_snapshot:
+            print("%10.1f  %s" % (next_snapshot, state.describe()))
+            last_snapshot = next_snapshot
+            next_snapshot = next_snapshot + args.every
+        state.apply(record)
+        last_time = record.time
+
+    # and where the trace ends, whether or not that falls on an interval
+    if last_time is not None and last_time != last_snapshot:
+        print("%10.1f  %s" % (last_time, state.describe()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,165 @@
+import collections
+import collections.abc
+import heapq
+import itertools
+import json
+import random
+import struct
+import sys
 import time
 from datetime import timedelta
 import threading
-import datetime
+
+class RealTimeClock:
+    """ Wall clock time, every scheduled call runs on its own timer thread """
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def now(self):
+        """ Seconds since the clock was made """
+        return time.monotonic() - self.started
+
+    def call_later(self, delay, callback, *args):
+        timer = threading.Timer(delay, callback, args)
+        timer.start()
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class ScheduledCall:
+    def __init__(self, when, sequence, callback, args):
+        self.when = when
+        self.sequence = sequence
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.sequence) < (other.when, other.sequence)
+
+    def cancel(self):
+        self.cancelled = True
+
+class VirtualClock:
+    """ Simulated time: scheduled calls sit in a priority queue and run() jumps straight from one to the next
+
+    Everything runs on the thread calling run(), in time order, and calls scheduled for the
+    same moment run in the order they were scheduled. Other threads hand work in with
+    call_soon_threadsafe.
+    """
+
+    def __init__(self, start=0.0):
+        self.time = start
+        self.queue = []
+        self.sequence = itertools.count()
+        self.incoming = collections.deque()  # from other threads, appends are atomic
+        self.stopping = False
+
+    def now(self):
+        return self.time
+
+    def call_later(self, delay, callback, *args):
+        call = ScheduledCall(self.now() + delay, next(self.sequence), callback, args)
+        heapq.heappush(self.queue, call)
+        return call
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.incoming.append((callback, args))
+
+    def take_incoming(self):
+        while self.incoming:
+            callback, args = self.incoming.popleft()
+            self.call_later(0, callback, *args)
+
+    def advance_to(self, when):
+        """ Moves time forward to `when`, False if it was interrupted before getting there """
+        self.time = max(self.time, when)
+        return True
+
+    def run(self, until=None):
+        """ Runs scheduled calls until there are none left or the next is after `until`, returns how many ran """
+        ran = 0
+        while not self.stopping:
+            self.take_incoming()
+            due = self.queue[0].when if self.queue else None
+
+            if until is not None and (due is None or due > until):
+                if self.advance_to(until):
+                    break
+                continue
+            if due is None:
+                break
+            if not self.advance_to(due):
+                continue
+
+            call = heapq.heappop(self.queue)
+            if call.cancelled:
+                continue
+            call.callback(*call.args)
+            ran = ran + 1
+        return ran
+
+    def run_until(self, when):
+        return self.run(until=when)
+
+    def sleep(self, seconds):
+        self.run(until=self.now() + seconds)
+
+class EventLoopClock(VirtualClock):
+    """ Real time on a single thread: the same scheduler as VirtualClock, but it waits for each call to be due
+
+    Presses from other threads go through call_soon_threadsafe (see Building.press_hall_button),
+    so every state change happens on the thread running the loop, one at a time, however many
+    producers there are.
+    """
+
+    def __init__(self):
+        super(EventLoopClock, self).__init__(start=time.monotonic())
+        self.wakeup = threading.Event()
+
+    def now(self):
+        return time.monotonic()
+
+    def call_soon_threadsafe(self, callback, *args):
+        super(EventLoopClock, self).call_soon_threadsafe(callback, *args)
+        self.wakeup.set()
+
+    def advance_to(self, when):
+        delay = when - time.monotonic()
+        if delay > 0 and self.wakeup.wait(delay):
+            self.wakeup.clear()
+            return False
+        self.time = max(self.time, when)
+        return True
+
+    def run_forever(self):
+        self.stopping = False
+        while not self.stopping:
+            self.run(until=self.now() + 60)
+
+    def stop(self):
+        def set_stopping():
+            self.stopping = True
+        self.call_soon_threadsafe(set_stopping)
 
 class Doors:
     OPEN = "open"
     CLOSED = "closed"
     WAIT_TIME_IN_SECONDS = 10
 
-    class WaitThread(threading.Thread):
-        def __init__(self, doors):
-            super(self.__class__, self).__init__()
-            self.doors = doors
-            self.start_of_wait = None
-
-        def run(self):
-            self.start_of_wait = datetime.datetime.now()
-            print("Doors start time set to " + str(self.start_of_wait))
-            seconds_waited = 0
-
-            print("Waiting for passengers to alight")
-            while seconds_waited < Doors.WAIT_TIME_IN_SECONDS:
-                print(str(seconds_waited))
-                time.sleep(1)
-                seconds_waited = seconds_waited + 1
-
-            # we are awakened!
-            self.doors.close()
+    __slots__ = ("status", "start_of_wait", "close_call", "parent", "passenger_triggered", "other_doors")
 
     def __init__(self, parent, locked_with=None, passenger_triggered=False):
         self.status = Doors.CLOSED
         self.start_of_wait = None
+        self.close_call = None
         self.parent = parent
+        self.other_doors = None
         self.passenger_triggered = passenger_triggered
         if locked_with:
             self.lock_with(locked_with)
@@ -43,7 +171,6 @@ class Doors:
         return self.status == Doors.CLOSED
 
     def lock_with(self, other_doors):
-        print(self.parent.get_name() + " doors locking with " + other_doors.parent.get_name() + " doors")
         self.other_doors = other_doors
         other_doors.other_doors = self
 
@@ -51,16 +178,20 @@ class Doors:
         if not self.other_doors:
             raise Exception("Cannot open if not locked with other doors")
 
-        print(self.parent.get_name() + " doors opening")
         self.status = Doors.OPEN
         if not self.other_doors.status == Doors.OPEN:
            self.other_doors.open()
 
         if self.passenger_triggered:
-            self.passenger_wait_thread = Doors.WaitThread(self)
-            self.passenger_wait_thread.start()
+            clock = self.parent.building.clock
+            # opening again while already open restarts the wait rather than closing twice
+            if self.close_call:
+                self.close_call.cancel()
+            self.start_of_wait = clock.now()
+            self.close_call = clock.call_later(Doors.WAIT_TIME_IN_SECONDS, self.close)
 
     def close(self):
+        self.close_call = None
         self.status = Doors.CLOSED
 
         if self.other_doors and not self.other_doors.status == Doors.CLOSED:
@@ -73,25 +204,53 @@ class Elevator:
     STATIONARY = "stationary"
 
     ARRIVAL = "arrival"
+    SECONDS_PER_FLOOR = 2
 
-    class ElevatorMoveThread(threading.Thread):
-        def __init__(self, elevator):
-            super(self.__class__, self).__init__()
-            self.elevator = elevator
-
-        def run(self):
-            self.elevator.do_move()
-
-    def __init__(self, building, floors):
-        self.current_floor = floors[0]
+    def __init__(self, building, floors, number=0, name="elevator"):
+        self.number = number
+        self.name = name
+        self.stopped_at = floors[0]
         self.last_move_state = None
         self.current_move_state = Elevator.STATIONARY
+
+        # the trip under way: from where and when, and the floor we're planning to arrive at
+        self.trip_start = None
+        self.trip_started_at = None
+        self.trip_target = None
+        self.arrival_call = None
         self.building = building
-        self.doors = Doors(self, floors[0].doors, passenger_triggered=True)
-        self.floor_buttons = [Button(self, f) for f in floors]
+        self.doors = Doors(self, floors[0].shaft_doors[number], passenger_triggered=True)
+        if building.compact:
+            self.floor_buttons = CarButtons(self)
+        else:
+            self.floor_buttons = [Button(self, f) for f in floors]
+        self.passengers = []
+        # seconds spent moving or with the doors open, for utilization
+        self.busy_seconds = 0.0
+        self.doors_opened_at = None
+
+        # what this car has to answer, bit (number - 1) per floor: its own buttons and the hall calls assigned to it
+        self.car_calls = 0
+        self.up_calls = 0
+        self.down_calls = 0
 
     def get_name(self):
-        return "elevator"
+        return self.name
+
+    @property
+    def current_floor(self):
+        """ The floor we're at, or while moving the one we're coming up to """
+        if self.trip_target is None:
+            return self.stopped_at
+        passed = int((self.building.clock.now() - self.trip_started_at) / Elevator.SECONDS_PER_FLOOR + 1e-9)
+        if self.trip_target > self.trip_start:
+            number = min(self.trip_start + passed + 1, self.trip_target)
+        else:
+            number = max(self.trip_start - passed - 1, self.trip_target)
+        return self.building.floors[number - 1]
+
+    def wanted_floors(self):
+        return self.car_calls | self.up_calls | self.down_calls
 
     def move(self, direction):
         if direction not in [Elevator.UP, Elevator.DOWN] or not self.can_move():
@@ -99,44 +258,74 @@ class Elevator:
 
         self.current_move_state = direction
 
-        print("Elevator starting")
-        self.move_thread = Elevator.ElevatorMoveThread(self)
-        self.move_thread.start()
+        self.building.clock.call_later(0, self.do_move)
 
     def do_move(self):
         direction = self.current_move_state
 
-        self.current_floor = self.building.next_floor(direction, self.current_floor)
-        print("Elevator moving to floor " + str(self.current_floor.number))
-        time.sleep(2) # emulate the move
+        # goes straight to the next floor that needs us, one event however many floors that is
+        first = self.building.next_floor(direction, self.stopped_at)
+        self.trip_start = self.stopped_at.number
+        self.trip_started_at = self.building.clock.now()
+        self.building.record(Trace.DEPART, self, self.stopped_at, direction)
+        self.plan(direction, first.number)
 
-        if self.building.should_elevator_stop_at(self.current_floor):
+    def plan(self, direction, approaching):
+        target = self.building.next_stop(self, direction, approaching)
+        if target == self.trip_target:
+            return
+
+        if self.arrival_call:
+            self.arrival_call.cancel()
+        self.trip_target = target
+        self.building.record(Trace.PLAN, self, self.building.floors[approaching - 1], direction, target)
+        arrival = self.trip_started_at + abs(target - self.trip_start) * Elevator.SECONDS_PER_FLOOR # emulate the move
+        self.arrival_call = self.building.clock.call_later(max(0, arrival - self.building.clock.now()),
+                                                           self.arrive, direction)
+
+    def notify_calls_changed(self):
+        """ A call was added or answered by another car, so the next stop on this trip may have changed """
+        if self.trip_target is not None:
+            self.plan(self.current_move_state, self.current_floor.number)
+
+    def arrive(self, direction):
+        self.busy_seconds = self.busy_seconds + self.building.clock.now() - self.trip_started_at
+        self.stopped_at = self.building.floors[self.trip_target - 1]
+        self.trip_target = None
+        self.arrival_call = None
+
+        # calls can have been answered by another car since we planned, so check again
+        if self.building.should_elevator_stop_at(self.current_floor, self):
             self.stop(direction)
-        elif not self.building.allows_elevator_move(direction):
-            self.building.notify_stuck()
+        elif not self.building.allows_elevator_move(direction, self):
+            self.building.notify_stuck(self)
         else:
             self.do_move()
 
-    def audible_alert(self, alert_type):
-        print("Ding!!! " + alert_type)
-
     def can_move(self):
         return self.current_move_state == Elevator.STATIONARY and self.doors.are_closed()
 
     def stop(self, direction):
-        print("Elevator stopping at floor " + str(self.current_floor.number))
-        self.audible_alert(Elevator.ARRIVAL)
-        self.doors.lock_with(self.current_floor.doors)
-        if self.current_floor.wants_elevator():
-            self.doors.open()
-        self.current_floor.notify_elevator_arrival(direction)
-        self.last_move_state = self.current_move_state
+        self.building.record(Trace.ARRIVE, self, self.current_floor, direction)
+        self.doors.lock_with(self.current_floor.shaft_doors[self.number])
+        # answer the hall call for the way we'll leave, which isn't always the way we came
+        self.last_move_state = self.building.direction_served_at(self, self.current_floor, direction)
         self.current_move_state = Elevator.STATIONARY
 
+        # nobody to let on or off, so the doors never close to tell the building we're free again
+        if not self.building.serve_floor(self, self.current_floor, self.last_move_state):
+            self.building.notify_elevator_ready(self)
+
     def notify_doors_closed(self):
-        self.building.notify_elevator_ready()
+        self.busy_seconds = self.busy_seconds + self.building.clock.now() - self.doors_opened_at
+        self.doors_opened_at = None
+        self.building.record(Trace.DOORS_CLOSE, self, self.current_floor)
+        self.building.notify_elevator_ready(self)
 
     def notify_press(self, button):
+        self.building.record(Trace.PRESS_CAR, self, button.floor)
+        self.car_calls = self.car_calls | 1 << (button.floor.number - 1)
+        self.notify_calls_changed()
         button.floor.notify_target_floor()
         self.building.notify_press(button)
 
@@ -144,13 +333,14 @@ class Button():
     ON = "on"
     OFF = "off"
 
+    __slots__ = ("state", "parent", "floor")
+
     def __init__(self, parent, floor):
         self.state = Button.OFF
         self.parent = parent
         self.floor = floor
 
     def press(self):
-        print("Button for floor " + str(self.floor.number) + " pressed")
         self.state = Button.ON
         self.parent.notify_press(self)
 
@@ -159,17 +349,19 @@ class Button():
 
 
 class FloorConsole:
+    __slots__ = ("floor", "down_button", "up_button")
+
     def __init__(self, floor, has_up=True, has_down=True):
         self.floor = floor
         self.down_button = Button(self, floor) if has_down else None
         self.up_button = Button(self, floor) if has_up else None
 
     def notify_press(self, button):
-        print("Console notified of button for floor " + str(button.floor.number) + " being pressed")
-
         if button == self.down_button:
+            self.floor.building.record(Trace.PRESS_HALL, floor=self.floor, direction=Elevator.DOWN)
             self.floor.notify_down_passenger()
         else:
+            self.floor.building.record(Trace.PRESS_HALL, floor=self.floor, direction=Elevator.UP)
             self.floor.notify_up_passenger()
 
         self.floor.building.notify_press(button)
@@ -191,29 +383,42 @@ class FloorConsole:
         return "floor " + str(self.floor.number) + " console"
 
 class Floor:
-    def __init__(self, building, number, is_first=False, is_top=False):
+    __slots__ = ("number", "console", "shaft_doors", "doors", "has_up_passenger", "has_down_passenger",
+                 "is_target_floor", "building")
+
+    def __init__(self, building, number, is_first=False, is_top=False, shaft_count=1):
         self.number = number
         self.console = FloorConsole(self, has_up=not is_top, has_down=not is_first)
-        self.doors = Doors(self)
+        # landing doors, one set per elevator shaft
+        self.shaft_doors = [Doors(self) for i in range(shaft_count)]
+        self.doors = self.shaft_doors[0]
         self.has_up_passenger = self.has_down_passenger = self.is_target_floor = False
         self.building = building
 
     def notify_elevator_arrival(self, direction):
-        self.console.notify_elevator_arrival(direction)
-        self.is_target_floor = False
+        if direction:
+            self.console.notify_elevator_arrival(direction)
+        # another car may still be on its way here
+        bit = 1 << (self.number - 1)
+        elevators = self.building.elevators
+        self.is_target_floor = any(car.car_calls & bit for car in elevators)
         if direction == Elevator.UP:
-            self.has_up_passenger = False
+            self.has_up_passenger = any(car.up_calls & bit for car in elevators)
         elif direction == Elevator.DOWN:
-            self.has_down_passenger = False
+            self.has_down_passenger = any(car.down_calls & bit for car in elevators)
+        self.building.notify_floor_calls(self)
 
     def notify_down_passenger(self):
         self.has_down_passenger = True
+        self.building.notify_floor_calls(self)
 
     def notify_up_passenger(self):
         self.has_up_passenger = True
+        self.building.notify_floor_calls(self)
 
     def notify_target_floor(self):
         self.is_target_floor = True
+        self.building.notify_floor_calls(self)
 
     def notify_doors_closed(self):
         """ Do Nothing """
@@ -224,24 +429,543 @@ class Floor:
     def get_name(self):
         return "floor " + str(self.number)
 
+def with_floor(mask, number, on):
+    """ `mask` with the bit for floor `number` set or cleared """
+    bit = 1 << (number - 1)
+    return mask | bit if on else mask & ~bit
+
+class FloorView(Floor):
+    """ A floor of a compact Building, its flags are the building's call bits """
+
+    __slots__ = ()
+
+    def __init__(self, building, number):
+        self.building = building
+        self.number = number
+
+    def __eq__(self, other):
+        return type(other) is FloorView and other.number == self.number and other.building is self.building
+
+    def __hash__(self):
+        return hash((id(self.building), self.number))
+
+    @property
+    def has_up_passenger(self):
+        return self.building.up_calls >> (self.number - 1) & 1 == 1
+
+    @has_up_passenger.setter
+    def has_up_passenger(self, value):
+        self.building.up_calls = with_floor(self.building.up_calls, self.number, value)
+
+    @property
+    def has_down_passenger(self):
+        return self.building.down_calls >> (self.number - 1) & 1 == 1
+
+    @has_down_passenger.setter
+    def has_down_passenger(self, value):
+        self.building.down_calls = with_floor(self.building.down_calls, self.number, value)
+
+    @property
+    def is_target_floor(self):
+        return self.building.car_calls >> (self.number - 1) & 1 == 1
+
+    @is_target_floor.setter
+    def is_target_floor(self, value):
+        self.building.car_calls = with_floor(self.building.car_calls, self.number, value)
+
+    @property
+    def console(self):
+        return ConsoleView(self)
+
+    @property
+    def shaft_doors(self):
+        return [LandingDoorsView(self, shaft) for shaft in range(len(self.building.landing_doors_open))]
+
+    @property
+    def doors(self):
+        return LandingDoorsView(self, 0)
+
+class FloorViews(collections.abc.Sequence):
+    """ Building.floors for a compact Building """
+
+    __slots__ = ("building", "count")
+
+    def __init__(self, building, count):
+        self.building = building
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index = index + self.count
+        if not 0 <= index < self.count:
+            raise IndexError("No floor " + str(index + 1))
+        return FloorView(self.building, index + 1)
+
+class ConsoleView(FloorConsole):
+    __slots__ = ()
+
+    def __init__(self, floor):
+        self.floor = floor
+
+    @property
+    def up_button(self):
+        return ButtonView(self, self.floor, 0) if self.floor.number < len(self.floor.building.floors) else None
+
+    @property
+    def down_button(self):
+        return ButtonView(self, self.floor, 1) if self.floor.number > 1 else None
+
+class ButtonView(Button):
+    """ A button whose light is a bit in Building.button_lights[lights]: 0 up, 1 down, 2 + n car n's """
+
+    __slots__ = ("lights",)
+
+    def __init__(self, parent, floor, lights):
+        self.parent = parent
+        self.floor = floor
+        self.lights = lights
+
+    def __eq__(self, other):
+        return type(other) is ButtonView and other.lights == self.lights and other.floor == self.floor
+
+    def __hash__(self):
+        return hash((self.floor, self.lights))
+
+    @property
+    def state(self):
+        lit = self.floor.building.button_lights[self.lights] >> (self.floor.number - 1) & 1
+        return Button.ON if lit else Button.OFF
+
+    @state.setter
+    def state(self, value):
+        lights = self.floor.building.button_lights
+        lights[self.lights] = with_floor(lights[self.lights], self.floor.number, value == Button.ON)
+
+class CarButtons(collections.abc.Sequence):
+    """ Elevator.floor_buttons for a compact Building """
+
+    __slots__ = ("elevator",)
+
+    def __init__(self, elevator):
+        self.elevator = elevator
+
+    def __len__(self):
+        return len(self.elevator.building.floors)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return ButtonView(self.elevator, self.elevator.building.floors[index], 2 + self.elevator.number)
+
+class LandingDoorsView(Doors):
+    """ The landing doors of one shaft at one floor, open or closed by a bit in Building.landing_doors_open """
+
+    __slots__ = ("shaft",)
+
+    # only the car's doors time themselves
+    passenger_triggered = False
+
+    def __init__(self, floor, shaft):
+        self.parent = floor
+        self.shaft = shaft
+
+    def __eq__(self, other):
+        return type(other) is LandingDoorsView and other.shaft == self.shaft and other.parent == self.parent
+
+    def __hash__(self):
+        return hash((self.parent, self.shaft))
+
+    @property
+    def status(self):
+        open_floors = self.parent.building.landing_doors_open[self.shaft]
+        return Doors.OPEN if open_floors >> (self.parent.number - 1) & 1 else Doors.CLOSED
+
+    @status.setter
+    def status(self, value):
+        open_floors = self.parent.building.landing_doors_open
+        open_floors[self.shaft] = with_floor(open_floors[self.shaft], self.parent.number, value == Doors.OPEN)
+
+    @property
+    def other_doors(self):
+        """ The car's doors while it's locked to these """
+        car_doors = self.parent.building.elevators[self.shaft].doors
+        return car_doors if car_doors.other_doors == self else None
+
+    @other_doors.setter
+    def other_doors(self, value):
+        """ Nothing to keep, the car's doors say where they're locked """
+
+TraceRecord = collections.namedtuple("TraceRecord", "time kind elevator floor direction value")
+
+class Trace:
+    """ Typed simulation events in a bounded ring buffer, the oldest dropped once it's full
+
+    Each record has the simulated time, its kind, the car number (-1 for none), the floor number
+    (0 for none), a direction and a number whose meaning depends on the kind: the planned stop
+    for PLAN, the destination for BOARD and the origin for ALIGHT. echo prints them as they
+    happen. save/load use JSON lines for a .jsonl path and packed binary otherwise.
+    """
+
+    PRESS_HALL = "press_hall"
+    PRESS_CAR = "press_car"
+    ASSIGN = "assign"
+    DEPART = "depart"
+    PLAN = "plan"
+    ARRIVE = "arrive"
+    DOORS_OPEN = "doors_open"
+    DOORS_CLOSE = "doors_close"
+    BOARD = "board"
+    ALIGHT = "alight"
+    IDLE = "idle"
+    STUCK = "stuck"
+
+    KINDS = (PRESS_HALL, PRESS_CAR, ASSIGN, DEPART, PLAN, ARRIVE, DOORS_OPEN, DOORS_CLOSE, BOARD, ALIGHT, IDLE, STUCK)
+    DIRECTIONS = (None, Elevator.UP, Elevator.DOWN)
+    # time, kind, direction, elevator, floor, value
+    PACKED = struct.Struct("<dBBhii")
+
+    def __init__(self, capacity=100000, echo=False):
+        self.records = collections.deque(maxlen=capacity)
+        self.echo = echo
+
+    def record(self, time, kind, elevator=-1, floor=0, direction=None, value=0):
+        record = TraceRecord(time, kind, elevator, floor, direction, value)
+        self.records.append(record)
+        if self.echo:
+            print(Trace.format(record))
+
+    @staticmethod
+    def format(record):
+        line = "%10.1f  %-11s" % (record.time, record.kind)
+        if record.elevator >= 0:
+            line = line + "  elevator " + str(record.elevator + 1)
+        if record.floor:
+            line = line + "  floor " + str(record.floor)
+        if record.direction:
+            line = line + "  " + record.direction
+        if record.value:
+            line = line + "  -> " + str(record.value)
+        return line
+
+    def save(self, path):
+        if path.endswith(".jsonl"):
+            with open(path, "w") as f:
+                for record in self.records:
+                    f.write(json.dumps(record._asdict()) + "\n")
+        else:
+            with open(path, "wb") as f:
+                for record in self.records:
+                    f.write(Trace.PACKED.pack(record.time, Trace.KINDS.index(record.kind),
+                                              Trace.DIRECTIONS.index(record.direction),
+                                              record.elevator, record.floor, record.value))
+
+    @staticmethod
+    def load(path):
+        if path.endswith(".jsonl"):
+            with open(path) as f:
+                return [TraceRecord(**json.loads(line)) for line in f if line.strip()]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        return [TraceRecord(time, Trace.KINDS[kind], elevator, floor, Trace.DIRECTIONS[direction], value)
+                for time, kind, direction, elevator, floor, value in Trace.PACKED.iter_unpack(data)]
+
+class Passenger:
+    def __init__(self, origin, destination, arrived):
+        self.origin = origin
+        self.destination = destination
+        self.direction = Elevator.UP if destination > origin else Elevator.DOWN
+        self.arrived = arrived
+        self.boarded = None
+        self.alighted = None
+        self.elevator = None
+
+    def wait_time(self):
+        return self.boarded - self.arrived
+
+    def journey_time(self):
+        return self.alighted - self.arrived
+
+def floors_between(low, high):
+    """ Bits for the floors strictly between two floor numbers """
+    low, high = min(low, high), max(low, high)
+    if high - low < 2:
+        return 0
+    return ((1 << (high - 1)) - 1) & ~((1 << low) - 1)
+
+def floors_from(low, high):
+    """ Bits for the floors from one floor number to another, both included """
+    low, high = min(low, high), max(low, high)
+    return ((1 << high) - 1) & ~((1 << (low - 1)) - 1)
+
+def count_floors(mask):
+    return bin(mask).count("1")
+
+class Dispatcher:
+    """ Decides which car answers a hall call: the one with the lowest cost (estimated seconds), the first on a tie """
+
+    # destination dispatch: passengers say where they're going at the hall, and wait for the car they're given
+    uses_destinations = False
+
+    def assign(self, building, floor_number, direction, destination=None):
+        return min(building.elevators,
+                   key=lambda car: (self.cost(building, car, floor_number, direction, destination), car.number))
+
+    def cost(self, building, car, floor_number, direction, destination=None):
+        raise NotImplementedError()
+
+class NearestCarDispatcher(Dispatcher):
+    """ The closest car, unless it's moving away from the call or past it in the other direction """
+
+    def cost(self, building, car, floor_number, direction, destination=None):
+        position = car.current_floor.number
+        distance = abs(position - floor_number)
+        if (car.current_move_state == Elevator.UP and (floor_number < position or direction != Elevator.UP)) \
+                or (car.current_move_state == Elevator.DOWN and (floor_number > position or direction != Elevator.DOWN)):
+            distance = distance + len(building.floors)
+        return distance * Elevator.SECONDS_PER_FLOOR
+
+class LookDispatcher(Dispatcher):
+    """ Estimated time to arrival following each car's LOOK sweep: on to its furthest call, then back """
+
+    def cost(self, building, car, floor_number, direction, destination=None):
+        return self.time_to_arrival(building, car, floor_number, direction)
+
+    def turning_floor(self, car, heading, position):
+        wanted = car.wanted_floors()
+        if heading == Elevator.UP:
+            above = wanted >> position
+            return position + above.bit_length() if above else position
+        below = wanted & ((1 << (position - 1)) - 1)
+        return (below & -below).bit_length() if below else position
+
+    def route(self, car, floor_number, direction):
+        """ The legs a car will travel before it reaches floor_number to go `direction` """
+        position = car.current_floor.number
+        heading = car.current_move_state
+        if heading == Elevator.STATIONARY:
+            # once free it carries on the way it last went if there's anything that way
+            heading = car.last_move_state
+            if heading not in (Elevator.UP, Elevator.DOWN) or self.turning_floor(car, heading, position) == position:
+                return [(position, floor_number)]
+
+        ahead = floor_number > position if heading == Elevator.UP else floor_number < position
+        if ahead and direction == heading:
+            return [(position, floor_number)]
+
+        turn = self.turning_floor(car, heading, position)
+        turn = max(turn, floor_number) if heading == Elevator.UP else min(turn, floor_number)
+        if direction != heading:
+            return [(position, turn), (turn, floor_number)]
+
+        # behind us and going our way: all the way back before coming round again
+        back = self.turning_floor(car, Elevator.DOWN if heading == Elevator.UP else Elevator.UP, turn)
+        back = min(back, floor_number) if heading == Elevator.UP else max(back, floor_number)
+        return [(position, turn), (turn, back), (back, floor_number)]
+
+    def time_to_arrival(self, building, car, floor_number, direction):
+        seconds = 0.0
+        if car.doors.are_open() and car.doors.start_of_wait is not None:
+            seconds = max(0.0, Doors.WAIT_TIME_IN_SECONDS - (building.clock.now() - car.doors.start_of_wait))
+
+        legs = self.route(car, floor_number, direction)
+        covered = 0
+        for start, end in legs:
+            seconds = seconds + abs(end - start) * Elevator.SECONDS_PER_FLOOR
+            covered = covered | floors_from(start, end)
+
+        # every call on the way is a stop with the doors open
+        stops = car.wanted_floors() & covered & ~(1 << (floor_number - 1)) & ~(1 << (car.current_floor.number - 1))
+        return seconds + count_floors(stops) * Doors.WAIT_TIME_IN_SECONDS
+
+class DestinationDispatcher(LookDispatcher):
+    """ Destination dispatch: adds the ride to the estimate and charges for extra stops, so passengers going
+    to the same floors get grouped into the same car """
+
+    uses_destinations = True
+
+    def cost(self, building, car, floor_number, direction, destination=None):
+        seconds = self.time_to_arrival(building, car, floor_number, direction)
+        if destination is None:
+            return seconds
+
+        wanted = car.wanted_floors()
+        seconds = seconds + abs(destination - floor_number) * Elevator.SECONDS_PER_FLOOR + Doors.WAIT_TIME_IN_SECONDS
+        seconds = seconds + count_floors(wanted & floors_between(floor_number, destination)) * Doors.WAIT_TIME_IN_SECONDS
+
+        # a stop the car makes anyway costs the people already riding nothing extra
+        new_stops = (0 if wanted & 1 << (floor_number - 1) else 1) + (0 if wanted & 1 << (destination - 1) else 1)
+        return seconds + new_stops * Doors.WAIT_TIME_IN_SECONDS * len(car.passengers)
+
 class Building:
-    def __init__(self, floor_count):
-        self.floors = [Floor(self, i, is_first=(i == 1), is_top=(i == floor_count)) for i in range(1, floor_count+1)]
-        self.elevator = Elevator(self, self.floors)
+    def __init__(self, floor_count, clock=None, elevator_count=1, dispatcher=None, trace=None, compact=False):
+        self.clock = clock or RealTimeClock()
+        # off unless asked for, bulk runs shouldn't pay for it
+        self.trace = trace
+        self.dispatcher = dispatcher or LookDispatcher()
+
+        # which floors want service, bit (number - 1) is set for floor `number`, kept in step by notify_floor_calls
+        self.up_calls = 0
+        self.down_calls = 0
+        self.car_calls = 0
+
+        # compact keeps no objects per floor: floors, consoles, buttons and landing doors are made on demand
+        # as views of these bits, and the floor flags above are the call bits themselves
+        self.compact = compact
+        if compact:
+            self.floors = FloorViews(self, floor_count)
+            # lit buttons: up, down, then each car's
+            self.button_lights = [0] * (2 + elevator_count)
+            # open landing doors per shaft
+            self.landing_doors_open = [0] * elevator_count
+        else:
+            self.floors = [Floor(self, i, is_first=(i == 1), is_top=(i == floor_count), shaft_count=elevator_count)
+                           for i in range(1, floor_count+1)]
+
+        if elevator_count == 1:
+            self.elevators = [Elevator(self, self.floors)]
+        else:
+            self.elevators = [Elevator(self, self.floors, number=i, name="elevator " + str(i + 1))
+                              for i in range(elevator_count)]
+        self.elevator = self.elevators[0]
+
+        self.waiting = {}  # floor number -> passengers waiting there
+        self.delivered = []
+
+    def record(self, kind, elevator=None, floor=None, direction=None, value=0):
+        if self.trace is not None:
+            self.trace.record(self.clock.now(), kind, elevator.number if elevator else -1,
+                              floor.number if floor else 0, direction, value)
+
+    def press_hall_button(self, floor_number, direction):
+        """ Safe to call from any thread, the press itself happens on the clock's thread """
+        console = self.floors[floor_number - 1].console
+        button = console.up_button if direction == Elevator.UP else console.down_button
+        if not button:
+            raise ValueError("Floor " + str(floor_number) + " has no " + str(direction) + " button")
+        self.clock.call_soon_threadsafe(button.press)
+
+    def press_car_button(self, floor_number, elevator_number=0):
+        """ Safe to call from any thread, the press itself happens on the clock's thread """
+        self.clock.call_soon_threadsafe(self.elevators[elevator_number].floor_buttons[floor_number - 1].press)
+
+    def add_passenger(self, origin, destination):
+        """ Someone turns up at `origin` wanting `destination`, and calls a car the way the dispatcher works """
+        if origin == destination or not 1 <= origin <= len(self.floors) or not 1 <= destination <= len(self.floors):
+            raise ValueError("Can't travel from floor " + str(origin) + " to floor " + str(destination))
+
+        passenger = Passenger(origin, destination, self.clock.now())
+        self.waiting.setdefault(origin, []).append(passenger)
+        floor = self.floors[origin - 1]
+
+        if self.dispatcher.uses_destinations:
+            passenger.elevator = self.dispatcher.assign(self, origin, passenger.direction, destination)
+            if passenger.direction == Elevator.UP:
+                floor.notify_up_passenger()
+            else:
+                floor.notify_down_passenger()
+            self.call_elevator(passenger.elevator, floor, passenger.direction)
+        elif passenger.direction == Elevator.UP:
+            floor.console.up_button.press()
+        else:
+            floor.console.down_button.press()
+        return passenger
 
     def notify_press(self, button):
-        print("Building notified of elevator button press for floor " + str(button.floor.number))
-        if self.elevator.current_floor.number == button.floor.number:
-            self.elevator.doors.open()
-        elif self.elevator.can_move():
-            print("The elevator can in fact move")
-            direction = Elevator.UP if self.elevator.current_floor.number < button.floor.number else Elevator.DOWN
-            self.elevator.move(direction)
-
-    def allows_elevator_move(self, direction):
-        if direction == Elevator.UP and self.elevator.current_floor.number == len(self.floors):
+        if isinstance(button.parent, Elevator):
+            self.send(button.parent, button.floor, None)
+            return
+
+        direction = Elevator.UP if button == button.parent.up_button else Elevator.DOWN
+        car = self.dispatcher.assign(self, button.floor.number, direction)
+        self.call_elevator(car, button.floor, direction)
+
+    def call_elevator(self, car, floor, direction):
+        self.record(Trace.ASSIGN, car, floor, direction)
+        bit = 1 << (floor.number - 1)
+        if direction == Elevator.UP:
+            car.up_calls = car.up_calls | bit
+        else:
+            car.down_calls = car.down_calls | bit
+        car.notify_calls_changed()
+        self.send(car, floor, direction)
+
+    def send(self, car, floor, direction):
+        if car.current_floor == floor and car.current_move_state == Elevator.STATIONARY:
+            if direction is not None:
+                car.last_move_state = direction
+            self.serve_floor(car, floor, direction)
+        elif car.can_move():
+            car.move(Elevator.UP if car.current_floor.number < floor.number else Elevator.DOWN)
+
+    def serve_floor(self, car, floor, direction):
+        """ Lets people off and on a stopped car and clears the calls it answered, False if there was no one """
+        bit = 1 << (floor.number - 1)
+        alighting = [p for p in car.passengers if p.destination == floor.number]
+        boarding = [p for p in self.waiting.get(floor.number, [])
+                    if p.direction == direction and (p.elevator is None or p.elevator is car)]
+        hall_call = (direction == Elevator.UP and floor.has_up_passenger) \
+            or (direction == Elevator.DOWN and floor.has_down_passenger)
+        if not (car.car_calls & bit or hall_call or alighting or boarding):
+            return False
+
+        if car.doors.other_doors != floor.shaft_doors[car.number]:
+            car.doors.lock_with(floor.shaft_doors[car.number])
+        if car.doors_opened_at is None:
+            car.doors_opened_at = self.clock.now()
+        car.doors.open()
+        self.record(Trace.DOORS_OPEN, car, floor, direction)
+        car.car_calls = car.car_calls & ~bit
+        car.floor_buttons[floor.number - 1].disable_light()
+        # with destination dispatch whoever is left waiting was given another car, which still has to come
+        for other in ([car] if self.dispatcher.uses_destinations else self.elevators):
+            if direction == Elevator.UP:
+                other.up_calls = other.up_calls & ~bit
+            elif direction == Elevator.DOWN:
+                other.down_calls = other.down_calls & ~bit
+            if other is not car:
+                other.notify_calls_changed()
+        floor.notify_elevator_arrival(direction)
+
+        now = self.clock.now()
+        for passenger in alighting:
+            car.passengers.remove(passenger)
+            passenger.alighted = now
+            self.delivered.append(passenger)
+            self.record(Trace.ALIGHT, car, floor, value=passenger.origin)
+        for passenger in boarding:
+            self.waiting[floor.number].remove(passenger)
+            passenger.boarded = now
+            passenger.elevator = car
+            car.passengers.append(passenger)
+            self.record(Trace.BOARD, car, floor, direction, passenger.destination)
+            car.floor_buttons[passenger.destination - 1].press()
+        return True
+
+    def direction_served_at(self, car, floor, direction):
+        """ The way a car stopping at `floor` while going `direction` will leave """
+        if direction == Elevator.UP:
+            if floor.has_up_passenger or car.wanted_floors() >> floor.number:
+                return Elevator.UP
+            if floor.has_down_passenger:
+                return Elevator.DOWN
+        elif direction == Elevator.DOWN:
+            if floor.has_down_passenger or car.wanted_floors() & ((1 << (floor.number - 1)) - 1):
+                return Elevator.DOWN
+            if floor.has_up_passenger:
+                return Elevator.UP
+        return direction
+
+    def allows_elevator_move(self, direction, elevator=None):
+        elevator = elevator or self.elevator
+        if direction == Elevator.UP and elevator.current_floor.number == len(self.floors):
             return False
-        elif direction == Elevator.DOWN and self.elevator.current_floor.number == 1:
+        elif direction == Elevator.DOWN and elevator.current_floor.number == 1:
             return False
         else:
             return True
@@ -257,53 +981,152 @@ class Building:
             incrementer = 1 if direction == Elevator.UP else -1
             return self.floors[current_floor.number - 1 + incrementer]
 
-    def notify_elevator_ready(self):
-        any_higher_floors_want_elevator = any([floor for floor in self.floors
-                                                                 if floor.number > self.elevator.current_floor.number
-                                                                 and floor.wants_elevator()])
-        any_lower_floors_want_elevator = any([floor for floor in self.floors
-                                                                 if floor.number < self.elevator.current_floor.number
-                                                                 and floor.wants_elevator()])
-
-        if self.elevator.last_move_state == Elevator.UP and any_higher_floors_want_elevator:
-            self.elevator.move(Elevator.UP)
-        elif self.elevator.last_move_state == Elevator.UP and any_lower_floors_want_elevator:
-            self.elevator.move(Elevator.DOWN)
-        elif self.elevator.last_move_state == Elevator.DOWN and any_lower_floors_want_elevator:
-            self.elevator.move(Elevator.DOWN)
-        elif self.elevator.last_move_state == Elevator.DOWN and any_higher_floors_want_elevator:
-            self.elevator.move(Elevator.UP)
+    def notify_floor_calls(self, floor):
+        bit = 1 << (floor.number - 1)
+        self.up_calls = self.up_calls | bit if floor.has_up_passenger else self.up_calls & ~bit
+        self.down_calls = self.down_calls | bit if floor.has_down_passenger else self.down_calls & ~bit
+        self.car_calls = self.car_calls | bit if floor.is_target_floor else self.car_calls & ~bit
+
+    def notify_elevator_ready(self, elevator=None):
+        elevator = elevator or self.elevator
+        wanted = elevator.wanted_floors()
+        any_higher_floors_want_elevator = wanted >> elevator.current_floor.number != 0
+        any_lower_floors_want_elevator = wanted & ((1 << (elevator.current_floor.number - 1)) - 1) != 0
+
+        if elevator.last_move_state == Elevator.UP and any_higher_floors_want_elevator:
+            elevator.move(Elevator.UP)
+        elif elevator.last_move_state == Elevator.UP and any_lower_floors_want_elevator:
+            elevator.move(Elevator.DOWN)
+        elif elevator.last_move_state == Elevator.DOWN and any_lower_floors_want_elevator:
+            elevator.move(Elevator.DOWN)
+        elif elevator.last_move_state == Elevator.DOWN and any_higher_floors_want_elevator:
+            elevator.move(Elevator.UP)
         elif any_higher_floors_want_elevator:
-            self.elevator.move(Elevator.UP)
-        elif self.elevator.current_floor.number > 1:
-            self.elevator.move(Elevator.DOWN)
+            elevator.move(Elevator.UP)
+        elif elevator.current_floor.number > 1:
+            elevator.move(Elevator.DOWN)
         else:
-            print("Not moving elevator because there's nothing to do")
-
-    def should_elevator_stop_at(self, floor):
-        if self.elevator.current_move_state == Elevator.DOWN and floor.number == 1: # if we're going down stop at bottom floor
+            self.record(Trace.IDLE, elevator, elevator.current_floor)
+
+    def notify_stuck(self, elevator=None):
+        elevator = elevator or self.elevator
+        self.record(Trace.STUCK, elevator, elevator.current_floor, elevator.current_move_state)
+        elevator.stop(elevator.current_move_state)
+
+    def next_stop(self, elevator, direction, approaching):
+        """ The first floor from `approaching` on, going `direction`, where should_elevator_stop_at would stop
+        the car, or the end of the shaft if there's none. Found from the call bitmasks without walking the floors.
+        """
+        below_approaching = (1 << (approaching - 1)) - 1
+        if direction == Elevator.UP:
+            stops = (elevator.car_calls | elevator.up_calls) & ~below_approaching
+            # a down call stops a car going up only when nothing above it wants the car
+            highest = elevator.wanted_floors().bit_length()
+            if highest >= approaching and elevator.down_calls >> (highest - 1) & 1:
+                stops = stops | 1 << (highest - 1)
+            return (stops & -stops).bit_length() if stops else len(self.floors)
+
+        # going down we always stop at the bottom floor
+        stops = (elevator.car_calls | elevator.down_calls) & (below_approaching | 1 << (approaching - 1))
+        return stops.bit_length() if stops else 1
+
+    def should_elevator_stop_at(self, floor, elevator=None):
+        elevator = elevator or self.elevator
+        bit = 1 << (floor.number - 1)
+        if elevator.current_move_state == Elevator.DOWN and floor.number == 1: # if we're going down stop at bottom floor
             return True
-        elif not floor.wants_elevator():
+        elif not elevator.wanted_floors() & bit:
             return False
-        elif floor.is_target_floor:
+        elif elevator.car_calls & bit:
             return True
-        elif floor.has_up_passenger and self.elevator.current_move_state == Elevator.UP:
+        elif elevator.up_calls & bit and elevator.current_move_state == Elevator.UP:
             return True
-        elif floor.has_down_passenger \
-            and self.elevator.current_move_state == Elevator.UP \
-            and not any(f for f in self.floors if f.number > floor.number and f.wants_elevator()):
+        elif elevator.down_calls & bit \
+            and elevator.current_move_state == Elevator.UP \
+            and not elevator.wanted_floors() >> floor.number:
             return True
-        elif floor.has_down_passenger and self.elevator.current_move_state == Elevator.DOWN:
+        elif elevator.down_calls & bit and elevator.current_move_state == Elevator.DOWN:
             return True
         else:
             return False
 
+    def journey_stats(self):
+        """ Wait (arrival to boarding) and journey (arrival to alighting) times of the delivered passengers """
+        def summary(values):
+            if not values:
+                return None
+            values = sorted(values)
+            return {"mean": sum(values) / len(values), "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))], "max": values[-1]}
+
+        return {
+            "delivered": len(self.delivered),
+            "waiting": sum(len(passengers) for passengers in self.waiting.values()),
+            "riding": sum(len(car.passengers) for car in self.elevators),
+            "wait": summary([p.wait_time() for p in self.delivered]),
+            "journey": summary([p.journey_time() for p in self.delivered]),
+        }
+
+DISPATCHERS = {
+    "nearest": NearestCarDispatcher,
+    "look": LookDispatcher,
+    "destination": DestinationDispatcher,
+}
+
+def compare_dispatchers(floor_count=20, elevator_count=4, passengers_per_minute=12, minutes=60, seed=1):
+    """ Journey stats for each dispatcher on the same random traffic, run in simulated time """
+    results = {}
+    for name, dispatcher in sorted(DISPATCHERS.items()):
+        generator = random.Random(seed)
+        building = Building(floor_count, clock=VirtualClock(), elevator_count=elevator_count, dispatcher=dispatcher())
+        arrival = 0.0
+        while arrival < minutes * 60:
+            arrival = arrival + generator.expovariate(passengers_per_minute / 60.0)
+            origin, destination = generator.sample(range(1, floor_count + 1), 2)
+            building.clock.call_later(arrival, building.add_passenger, origin, destination)
+        building.clock.run(until=minutes * 60)
+        results[name] = building.journey_stats()
+    return results
+
 
 if __name__ == '__main__':
-    building = Building(10)
+    if '--bank' in sys.argv:
+        # 4 cars, 20 floors, an hour of a passenger every 5 seconds, per dispatcher
+        for name, stats in sorted(compare_dispatchers().items()):
+            print(name + ": delivered " + str(stats["delivered"])
+                  + ", mean wait " + str(round(stats["wait"]["mean"], 1))
+                  + "s, mean journey " + str(round(stats["journey"]["mean"], 1)) + "s")
+        sys.exit()
+
+    # --virtual runs the same presses in simulated time, finishing immediately, and --loop runs
+    # them in real time on this thread alone rather than a thread per move and door wait
+    virtual = '--virtual' in sys.argv
+    if virtual:
+        clock = VirtualClock()
+    elif '--loop' in sys.argv:
+        clock = EventLoopClock()
+    else:
+        clock = RealTimeClock()
+    # --trace FILE also saves the events, as JSON lines for a .jsonl name and packed binary otherwise
+    trace_path = sys.argv[sys.argv.index('--trace') + 1] if '--trace' in sys.argv else None
+    building = Building(10, clock=clock, trace=Trace(echo=True))
 
     building.floors[0].console.up_button.press()
-    time.sleep(2)
+    building.clock.sleep(2)
     building.elevator.floor_buttons[3].press() # this is floor 4
 
     building.floors[1].console.down_button.press() # this is floor 2
+
+    if not isinstance(clock, RealTimeClock):
+        building.clock.run()
+    else:
+        # the timers run on their own threads and start more, wait until none are left
+        others = [t for t in threading.enumerate() if t is not threading.current_thread()]
+        while others:
+            for thread in others:
+                thread.join()
+            others = [t for t in threading.enumerate() if t is not threading.current_thread()]
+    if trace_path:
+        building.trace.save(trace_path)
+    if virtual:
+        print("Simulated " + str(timedelta(seconds=building.clock.now())))
@@ -0,0 +1,206 @@
+""" Poisson passenger traffic for elevator_system, and a Monte Carlo runner over seeds and parameters.
+
+Every run drives a Building in simulated time: passengers arrive as a Poisson process over
+--hours, then the bank is left to deliver whoever is still waiting or riding. Runs are
+independent, so seeds and parameter combinations are spread over a process pool.
+
+    python elevator_traffic.py --floors 20 --cars 2 4 --profiles up_peak interfloor --rate 300 600
+    python elevator_traffic.py --dispatchers look destination --seeds 16 --json results.json
+
+Profiles:
+    up_peak    most people arrive at the lobby going up (morning)
+    down_peak  most people head down to the lobby (evening)
+    interfloor origins and destinations spread evenly over all floors
+    lunch      a mix of the three
+"""
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from elevator_system import Building, DISPATCHERS, VirtualClock
+
+PROFILES = ('up_peak', 'down_peak', 'interfloor', 'lunch')
+
+# share of passengers from the lobby, to the lobby and between other floors
+PROFILE_MIX = {
+    'up_peak': (0.85, 0.05, 0.10),
+    'down_peak': (0.05, 0.85, 0.10),
+    'interfloor': (0.0, 0.0, 1.0),
+    'lunch': (0.40, 0.40, 0.20),
+}
+
+# give up on delivering the last passengers after this long, an overloaded bank never catches up
+DRAIN_SECONDS = 3600
+
+
+def trip(profile, floor_count, generator):
+    from_lobby, to_lobby, between = PROFILE_MIX[profile]
+    pick = generator.random()
+    if pick < from_lobby:
+        return 1, generator.randint(2, floor_count)
+    if pick < from_lobby + to_lobby:
+        return generator.randint(2, floor_count), 1
+    return tuple(generator.sample(range(1, floor_count + 1), 2))
+
+
+def arrivals(profile, floor_count, passengers_per_hour, seconds, generator):
+    """ (time, origin, destination) for a Poisson process of passengers over `seconds` """
+    rate = passengers_per_hour / 3600.0
+    arrived = generator.expovariate(rate)
+    while arrived < seconds:
+        origin, destination = trip(profile, floor_count, generator)
+        yield arrived, origin, destination
+        arrived = arrived + generator.expovariate(rate)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def simulate(run):
+    """ One run, `run` is a dict of floors, cars, dispatcher, profile, rate, hours and seed """
+    generator = random.Random(run['seed'])
+    seconds = run['hours'] * 3600
+    building = Building(run['floors'], clock=VirtualClock(), elevator_count=run['cars'],
+                        dispatcher=DISPATCHERS[run['dispatcher']]())
+
+    started = time.perf_counter()
+    arrived_count = 0
+    for arrived, origin, destination in arrivals(run['profile'], run['floors'], run['rate'], seconds, generator):
+        building.clock.call_later(arrived, building.add_passenger, origin, destination)
+        arrived_count = arrived_count + 1
+    building.clock.run(until=seconds)
+    # let the bank finish delivering, a minute at a time so the clock stops near the last drop-off
+    while len(building.delivered) < arrived_count and building.clock.now() < seconds + DRAIN_SECONDS:
+        building.clock.run(until=building.clock.now() + 60)
+    elapsed = time.perf_counter() - started
+
+    delivered = building.delivered
+    waits = sorted(p.wait_time() for p in delivered)
+    rides = sorted(p.alighted - p.boarded for p in delivered)
+    journeys = sorted(p.journey_time() for p in delivered)
+    finished = max([seconds] + [p.alighted for p in delivered])
+    busy = sum(car.busy_seconds for car in building.elevators)
+
+    return dict(run, **{
+        'passengers': arrived_count,
+        'undelivered': arrived_count - len(delivered),
+        'throughput_per_hour': len(delivered) / finished * 3600,
+        'wait_mean': sum(waits) / len(waits) if waits else None,
+        'wait_p50': percentile(waits, 0.50),
+        'wait_p90': percentile(waits, 0.90),
+        'wait_p99': percentile(waits, 0.99),
+        'ride_mean': sum(rides) / len(rides) if rides else None,
+        'ride_p90': percentile(rides, 0.90),
+        'journey_mean': sum(journeys) / len(journeys) if journeys else None,
+        'utilization': min(1.0, busy / (finished * run['cars'])),
+        'wall_seconds': elapsed,
+    })
+
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def aggregate(results):
+    """ One row per parameter combination, averaging the KPIs over its seeds """
+    groups = {}
+    for result in results:
+        key = (result['profile'], result['dispatcher'], result['floors'], result['cars'], result['rate'])
+        groups.setdefault(key, []).append(result)
+
+    rows = []
+    for key in sorted(groups):
+        runs = groups[key]
+        row = dict(zip(('profile', 'dispatcher', 'floors', 'cars', 'rate'), key))
+        row['runs'] = len(runs)
+        for kpi in ('passengers', 'undelivered', 'throughput_per_hour', 'wait_mean', 'wait_p50', 'wait_p90',
+                    'wait_p99', 'ride_mean', 'ride_p90', 'journey_mean', 'utilization'):
+            row[kpi] = mean(r[kpi] for r in runs)
+        means = [r['wait_mean'] for r in runs if r['wait_mean'] is not None]
+        row['wait_mean_spread'] = (min(means), max(means)) if means else None
+        rows.append(row)
+    return rows
+
+
+# key, heading, width, format of the value
+COLUMNS = (
+    ('profile', 'profile', 10, '%s'),
+    ('dispatcher', 'dispatcher', 11, '%s'),
+    ('floors', 'floors', 6, '%d'),
+    ('cars', 'cars', 4, '%d'),
+    ('rate', 'pax/h', 6, '%g'),
+    ('runs', 'runs', 4, '%d'),
+    ('throughput_per_hour', 'deliv/h', 7, '%.0f'),
+    ('wait_mean', 'wait', 6, '%.1f'),
+    ('wait_p50', 'p50', 6, '%.1f'),
+    ('wait_p90', 'p90', 6, '%.1f'),
+    ('wait_p99', 'p99', 6, '%.1f'),
+    ('ride_mean', 'ride', 6, '%.1f'),
+    ('journey_mean', 'journey', 7, '%.1f'),
+    ('utilization', 'util', 5, '%.0f%%'),
+    ('undelivered', 'left', 5, '%.1f'),
+)
+
+
+def format_table(rows):
+    lines = [' '.join(heading.rjust(width) for key, heading, width, fmt in COLUMNS)]
+    for row in rows:
+        cells = []
+        for key, heading, width, fmt in COLUMNS:
+            value = row[key]
+            if value is None:
+                text = '-'
+            elif key == 'utilization':
+                text = fmt % (value * 100)
+            else:
+                text = fmt % value
+            cells.append(text.rjust(width))
+        lines.append(' '.join(cells))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--floors', type=int, nargs='*', default=[20])
+    parser.add_argument('--cars', type=int, nargs='*', default=[4])
+    parser.add_argument('--dispatchers', nargs='*', default=sorted(DISPATCHERS), choices=sorted(DISPATCHERS))
+    parser.add_argument('--profiles', nargs='*', default=list(PROFILES), choices=PROFILES)
+    parser.add_argument('--rate', type=float, nargs='*', default=[600], help="passengers per hour")
+    parser.add_argument('--hours', type=float, default=1.0, help="simulated hours of arrivals per run")
+    parser.add_argument('--seeds', type=int, default=4, help="runs per parameter combination")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--json', help="also write every run and the table rows to this file")
+    args = parser.parse_args()
+
+    runs = [{'floors': floors, 'cars': cars, 'dispatcher': dispatcher, 'profile': profile, 'rate': rate,
+             'hours': args.hours, 'seed': seed}
+            for floors in args.floors for cars in args.cars for dispatcher in args.dispatchers
+            for profile in args.profiles for rate in args.rate for seed in range(args.seeds)]
+
+    started = time.perf_counter()
+    if args.processes == 1:
+        results = [simulate(run) for run in runs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            results = list(executor.map(simulate, runs, chunksize=max(1, len(runs) // (args.processes * 4))))
+    elapsed = time.perf_counter() - started
+
+    rows = aggregate(results)
+    print(format_table(rows))
+    print("%d runs, %.0f simulated hours in %.1f s" % (len(runs), len(runs) * args.hours, elapsed))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'runs': results, 'table': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
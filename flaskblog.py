@@ -1,10 +1,17 @@
-from flask import Flask, render_template
+from flask import Flask
+from instrumentation import Metrics
+from static_assets import StaticAssets
 app = Flask(__name__)
+metrics = Metrics(app)
+assets = StaticAssets(app)
+
+# the page has no per-request data, so render it once per process rather than per request
+index_page = assets.prerender("index.html")
 
 
 @app.route("/")
 def hello():
-    return render_template("index.html")
+    return index_page.response()
 
 if __name__ == '__main__':
       # app.run(port=80)
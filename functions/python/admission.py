@@ -0,0 +1,134 @@
+""" Turns away log-in and sign-up attempts before they cost a database lookup and a bcrypt run.
+
+Each attempt draws one token from a bucket per source IP and one per email. A bucket holds up
+to `burst` tokens and refills at `per_minute`, so an address can try in short bursts but not
+keep it up. An attempt is turned away if any of its buckets is empty, and then it takes
+nothing from the others: a throttled address can't drain someone else's email bucket.
+
+Buckets live in memory per container, or in a shared store when take_shared is given:
+take_shared(buckets, now) gets [(bucket_id, burst, per_second)], takes a token from each
+only if all have one, and returns the ids of the buckets that were empty. If the shared
+store fails, this container falls back to its own buckets for retry_after_seconds.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBuckets:
+    """ In-memory buckets, least recently used dropped past max_size (a dropped bucket is full again) """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.buckets = OrderedDict()  # bucket_id -> [tokens, updated]
+        self.lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """ Ids of the buckets that were empty; a token comes out of every bucket only when there are none """
+        with self.lock:
+            entries = []
+            for bucket_id, burst, per_second in buckets:
+                bucket = self.buckets.get(bucket_id)
+                if bucket is None:
+                    bucket = self.buckets[bucket_id] = [float(burst), now]
+                else:
+                    bucket[0] = min(float(burst), bucket[0] + max(0.0, now - bucket[1]) * per_second)
+                    bucket[1] = max(bucket[1], now)
+                    self.buckets.move_to_end(bucket_id)
+                entries.append((bucket_id, bucket))
+
+            empty = set(bucket_id for bucket_id, bucket in entries if bucket[0] < 1)
+            if not empty:
+                for bucket_id, bucket in entries:
+                    bucket[0] = bucket[0] - 1
+
+            while len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        return empty
+
+
+class Admission:
+    """ limits maps (action, 'ip' or 'email') to (burst, per_minute); a missing or 0 burst means no limit """
+
+    def __init__(self, limits=None, take_shared=None, max_size=10000, retry_after_seconds=30.0, report_seconds=60.0,
+                 clock=time.time):
+        self.limits = dict(limits or {})
+        self.take_shared = take_shared
+        self.retry_after_seconds = retry_after_seconds
+        self.clock = clock
+        self.local = TokenBuckets(max_size)
+        self.shared_down_until = 0.0
+        self.report_seconds = report_seconds
+        self.reported_at = None
+
+        self.counts = {}  # action -> {'admitted': n, 'rejected_ip': n, 'rejected_email': n}
+        self.shared_errors = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def bucket_id(action, kind, value):
+        # fixed size whatever the caller sent, and no email addresses sitting in the store
+        return hashlib.blake2b(('%s:%s:%s' % (action, kind, value)).encode('utf-8'), digest_size=16).hexdigest()
+
+    def take(self, buckets):
+        now = self.clock()
+        if self.take_shared is not None and now >= self.shared_down_until:
+            try:
+                return self.take_shared(buckets, now)
+            except Exception:
+                logger.warning("Shared admission store failed, using this container's buckets for %ss",
+                               self.retry_after_seconds, exc_info=True)
+                with self.lock:
+                    self.shared_errors = self.shared_errors + 1
+                self.shared_down_until = now + self.retry_after_seconds
+        return self.local.take(buckets, now)
+
+    def rejected_by(self, action, ip=None, email=None):
+        """ 'ip' or 'email' for the bucket that turned the attempt away, None if it may go ahead """
+        wanted = []
+        for kind, value in (('ip', ip), ('email', email.strip().lower() if email else email)):
+            burst, per_minute = self.limits.get((action, kind), (0, 0))
+            if value and burst > 0:
+                wanted.append((kind, (self.bucket_id(action, kind, value), burst, per_minute / 60.0)))
+
+        rejected = None
+        if wanted:
+            empty = self.take([bucket for kind, bucket in wanted])
+            for kind, bucket in wanted:
+                if bucket[0] in empty:
+                    rejected = kind
+                    break
+
+        with self.lock:
+            counts = self.counts.setdefault(action, {'admitted': 0, 'rejected_ip': 0, 'rejected_email': 0})
+            key = 'admitted' if rejected is None else 'rejected_' + rejected
+            counts[key] = counts[key] + 1
+        return rejected
+
+    def report_due(self):
+        """ True at most once per report_seconds, for logging what's been shed without a line per rejection """
+        now = self.clock()
+        with self.lock:
+            if self.reported_at is not None and now - self.reported_at < self.report_seconds:
+                return False
+            self.reported_at = now
+            return True
+
+    def shed(self):
+        """ Attempts turned away, each one a password hash that never ran """
+        with self.lock:
+            return sum(counts['rejected_ip'] + counts['rejected_email'] for counts in self.counts.values())
+
+
+def source_ip(event):
+    """ The caller's address from an API Gateway REST (v1) or HTTP API (v2) event, None if there isn't one """
+    context = event.get('requestContext') or {}
+    for section in ('identity', 'http'):
+        ip = (context.get(section) or {}).get('sourceIp')
+        if ip:
+            return ip
+    return None
@@ -0,0 +1,124 @@
+""" Floods user_log_in and user_sign_up the way a password-guessing script would, with and without admission.
+
+Real users log in from their own addresses while a few attacker addresses guess passwords
+for one account and script sign-ups. Each run reports the bcrypt work done, what admission
+shed, and how real users' log-ins fared (latency and SERVICE_BUSY / TOO_MANY_ATTEMPTS).
+
+    python -m benchmarks.admission_flood --attempts 2000 --concurrency 8
+    DB_HOST=localhost DB_NAME=postgres python -m benchmarks.admission_flood --db postgres --store database
+
+--store database runs the admission buckets through "user".admission_buckets (migration 4).
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function
+from benchmarks.fake_db import FakeDatabase
+
+
+def event(body, ip):
+    return {'body': json.dumps(body), 'requestContext': {'identity': {'sourceIp': ip}}}
+
+
+def make_requests(users, args):
+    """ (kind, handler, event) shuffled: guesses, scripted sign-ups and real log-ins """
+    requests = []
+    victim = users[0]['email']
+    for i in range(args.attempts):
+        ip = '203.0.113.%d' % (i % args.attacker_ips)
+        if i % 2:
+            requests.append(('attack', lambda_function.user_log_in,
+                             event({'email': victim, 'password': uuid.uuid4().hex}, ip)))
+        else:
+            email = 'flood-%s@example.com' % uuid.uuid4().hex
+            requests.append(('attack', lambda_function.user_sign_up,
+                             event({'email': email, 'password': 'password', 'first_name': 'Flood', 'last_name': 'Bot'},
+                                   ip)))
+    for i in range(args.logins):
+        user = users[1 + i % (len(users) - 1)]
+        requests.append(('user', lambda_function.user_log_in,
+                         event({'email': user['email'], 'password': 'password'}, user['ip'])))
+    random.Random(args.seed).shuffle(requests)
+    return requests
+
+
+def call(request):
+    kind, handler, event = request
+    started = time.perf_counter()
+    body = json.loads(handler(event, None)['body'])
+    return kind, (time.perf_counter() - started) * 1000, body.get('message_key')
+
+
+def run(users, args, limits=None):
+    take_shared = lambda_function.take_admission_tokens if limits and args.store == 'database' else None
+    lambda_function.admission = lambda_function.Admission(limits, take_shared=take_shared)
+    hasher = lambda_function.password_hasher
+    hashes, hash_seconds = hasher.hashes, hasher.hash_seconds
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(call, make_requests(users, args)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(ms for kind, ms, outcome in samples if kind == 'user')
+    outcomes = {}
+    for kind, ms, outcome in samples:
+        outcomes.setdefault(kind, {})
+        outcomes[kind][outcome] = outcomes[kind].get(outcome, 0) + 1
+
+    return {
+        'wall_seconds': wall,
+        'bcrypt_runs': hasher.hashes - hashes,
+        'bcrypt_seconds': hasher.hash_seconds - hash_seconds,
+        'outcomes': outcomes,
+        'user_log_in_ms': {'p50': statistics.median(latencies),
+                           'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                           'max': latencies[-1]},
+        'admission': lambda_function.admission_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', choices=('fake', 'postgres'), default='fake')
+    parser.add_argument('--store', choices=('memory', 'database'), default='memory')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--logins', type=int, default=200, help="real users' log-ins during the flood")
+    parser.add_argument('--attempts', type=int, default=1000, help="attacker requests, half guesses and half sign-ups")
+    parser.add_argument('--attacker-ips', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bcrypt-rounds', type=int, default=lambda_function.password_hasher.rounds)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.db == 'fake':
+        lambda_function.pool.connect = FakeDatabase().connect
+        lambda_function.replica_set = lambda_function.ReplicaSet()
+    lambda_function.pool.max_size = args.concurrency
+    hasher = lambda_function.password_hasher
+    hasher.rounds = hasher.min_rounds = args.bcrypt_rounds
+    # the limits this deployment is configured with
+    limits = lambda_function.admission.limits
+
+    lambda_function.admission = lambda_function.Admission()
+    users = []
+    for i in range(args.users + 1):
+        email = 'flood-user-%s@example.com' % uuid.uuid4().hex
+        lambda_function.user_sign_up(event({'email': email, 'password': 'password',
+                                            'first_name': 'Real', 'last_name': 'User'}, None), None)
+        users.append({'email': email, 'ip': '198.51.100.%d' % (i % 250)})
+
+    print(json.dumps({
+        'config': dict(vars(args), limits=dict(('%s %s' % key, value) for key, value in limits.items())),
+        'without_admission': run(users, args),
+        'with_admission': run(users, args, limits),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
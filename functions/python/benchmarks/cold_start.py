@@ -0,0 +1,67 @@
+""" Measures cold start: a fresh interpreter importing lambda_function and serving its first request.
+
+Run from functions/python with credentials pointed at a local database, e.g.
+
+    DB_HOST=localhost DB_NAME=postgres python -m benchmarks.cold_start --runs 10
+
+Each run is a new process, so nothing is shared between runs. Prints one JSON document.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs inside the child interpreter
+CHILD = """
+import json, time
+started = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+event = {'queryStringParameters': {'user_id': 'cold-start-user', 'token': 'cold-start-token'}}
+response = lambda_function.user_is_logged_in(event, None)
+responded = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'first_response_ms': (responded - imported) * 1000,
+                  'total_ms': (responded - started) * 1000,
+                  'boto3_imported': __import__('sys').modules.get('boto3') is not None,
+                  'response': json.loads(response['body'])}))
+"""
+
+
+def run_once():
+    output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=PYTHON_DIR, env=os.environ.copy())
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'p50': statistics.median(values),
+        'max': values[-1],
+        'mean': statistics.mean(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(json.dumps({
+        'runs': args.runs,
+        'boto3_imported': any(r['boto3_imported'] for r in runs),
+        'import_ms': summarize([r['import_ms'] for r in runs]),
+        'first_response_ms': summarize([r['first_response_ms'] for r in runs]),
+        'total_ms': summarize([r['total_ms'] for r in runs]),
+        'first_response': runs[-1]['response'],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
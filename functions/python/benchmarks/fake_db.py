@@ -0,0 +1,205 @@
+""" In-memory stand-in for the "user" schema, speaking just enough DB-API for the handlers.
+
+It understands the statements the handlers run, either as EXECUTE of the prepared form
+the query layer sends or as their plain SQL, and implements each one in Python with the
+same semantics (unique email, active/expiry checks, debounced last_checked writes...).
+Anything else raises, so a new handler query can't silently go unimplemented.
+
+    db = FakeDatabase(latency_ms=0.5)
+    lambda_function.pool.connect = db.connect
+"""
+import re
+import threading
+import time
+
+import lambda_function
+from admission import TokenBuckets
+from queries import Statement
+
+EXECUTE = re.compile(r'^EXECUTE (\w+)')
+
+
+class FakeError(Exception):
+    pass
+
+
+class FakeDatabase:
+    def __init__(self, latency_ms=0.0):
+        # per statement round trip, to stand in for the network
+        self.latency = latency_ms / 1000.0
+        self.users = {}  # user_id -> [first_name, last_name, email_address, password_encryption]
+        self.emails = {}  # email_address -> user_id
+        self.tokens = {}  # (user_id, token) -> [created, last_checked, is_active]
+        self.revoked = {}  # token_id -> (revoked, expires)
+        self.buckets = TokenBuckets(max_size=float('inf'))  # "user".admission_buckets
+        self.lock = threading.Lock()
+        self.statements = 0
+
+        self.by_sql = {}
+        for value in vars(lambda_function).values():
+            if isinstance(value, Statement):
+                self.by_sql[value.sql] = value.name
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def run(self, sql, parameters):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.statements = self.statements + 1
+
+            if sql.startswith('PREPARE ') or sql in ('SELECT 1', 'BEGIN'):
+                return [], 0
+
+            match = EXECUTE.match(sql)
+            name = match.group(1) if match else self.by_sql.get(sql)
+            if name is None:
+                raise FakeError("Fake database doesn't know: %s" % sql)
+
+            return getattr(self, name)(parameters)
+
+    def is_logged_in(self, p):
+        entry = self.tokens.get((p['user_id'], p['token']))
+        if p['user_id'] not in self.users or entry is None or not entry[2] or entry[1] <= p['last_checked_time']:
+            return [], 0
+
+        if entry[1] <= p['touch_before']:
+            entry[1] = p['now']
+        return [(entry[1],)], 1
+
+    def check_token(self, p):
+        entry = self.tokens.get((p['user_id'], p['token']))
+        if p['user_id'] not in self.users or entry is None or not entry[2] or entry[1] <= p['last_checked_time']:
+            return [], 0
+        return [(entry[1],)], 1
+
+    def log_in(self, p):
+        user_id = self.emails.get(p['email_address'])
+        if user_id is None:
+            return [], 0
+        return [(memoryview(self.users[user_id][3]), user_id)], 1
+
+    def create_token(self, p):
+        user_id, token, created, last_checked, is_active = p
+        if (user_id, token) in self.tokens:
+            raise FakeError("duplicate key value violates unique constraint")
+        self.tokens[(user_id, token)] = [created, last_checked, is_active]
+        return [], 1
+
+    def rehash_password(self, p):
+        password_encryption, user_id = p
+        if user_id not in self.users:
+            return [], 0
+        self.users[user_id][3] = bytes(password_encryption)
+        return [], 1
+
+    def email_exists(self, p):
+        return ([(1,)], 1) if p['email_address'] in self.emails else ([], 0)
+
+    def sign_up_user(self, p):
+        if p['email_address'] in self.emails:
+            return [], 0
+        self.users[p['user_id']] = [p['first_name'], p['last_name'], p['email_address'],
+                                    bytes(p['password_encryption'])]
+        self.emails[p['email_address']] = p['user_id']
+        return [(p['user_id'],)], 1
+
+    def sign_up(self, p):
+        rows, count = self.sign_up_user(p)
+        if rows:
+            self.tokens[(p['user_id'], p['token'])] = [p['now'], p['now'], True]
+        return rows, count
+
+    def log_out(self, p):
+        entry = self.tokens.get((p['user_id'], p['token']))
+        if entry is None:
+            return [], 0
+        entry[2] = False
+        return [], 1
+
+    def revoke_token(self, p):
+        if p['token_id'] in self.revoked:
+            return [], 0
+        self.revoked[p['token_id']] = (p['now'], p['expires'])
+        return [], 1
+
+    def revoked_since(self, p):
+        rows = [(token_id, revoked, expires) for token_id, (revoked, expires) in self.revoked.items()
+                if revoked > p['since'] and expires > p['now']]
+        return rows, len(rows)
+
+    def batch_is_logged_in(self, p):
+        rows = []
+        for user_id, token in set(zip(p['user_ids'], p['tokens'])):
+            found, count = self.is_logged_in(dict(p, user_id=user_id, token=token))
+            if found:
+                rows.append((user_id, token, found[0][0]))
+        return rows, len(rows)
+
+    def batch_log_out(self, p):
+        rows = []
+        for user_id, token in zip(p['user_ids'], p['tokens']):
+            found, count = self.log_out({'user_id': user_id, 'token': token})
+            if count:
+                rows.append((user_id, token))
+        return rows, len(rows)
+
+    def batch_revoke_tokens(self, p):
+        count = 0
+        for token_id, expires in zip(p['token_ids'], p['expires']):
+            count = count + self.revoke_token({'token_id': token_id, 'now': p['now'], 'expires': expires})[1]
+        return [], count
+
+    def take_admission(self, p):
+        buckets = list(zip(p['bucket_ids'], p['bursts'], p['per_seconds']))
+        empty = self.buckets.take(buckets, p['now'].timestamp())
+        return [(bucket_id,) for bucket_id in empty], len(empty)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, sql, parameters=None):
+        if self.connection.closed:
+            raise FakeError("connection already closed")
+        self.rows, self.rowcount = self.connection.db.run(sql, parameters)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.rows = []
@@ -0,0 +1,250 @@
+""" Replays synthetic API Gateway events against the auth handlers at a given concurrency.
+
+Runs entirely locally: credentials are never fetched, and the database is either the
+in-memory fake (default) or a real Postgres reached through the usual DB_* overrides.
+
+    python -m benchmarks.load_test --requests 2000 --concurrency 8
+    DB_HOST=localhost DB_NAME=postgres python -m benchmarks.load_test --db postgres --output results.json
+
+For every endpoint it reports throughput and p50/p95/p99 latency, and splits the mean
+latency into bcrypt, database, JSON serialization and everything else. The JSON document is
+printed and optionally written to --output so runs can be compared over time.
+
+After the log-outs, the denylist is reloaded (so a signed-token run crosses a refresh) and
+every user's token is checked once more; still_valid_after_log_out should be 0.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function
+import queries
+from benchmarks.fake_db import FakeDatabase
+
+ENDPOINTS = ('user_sign_up', 'user_log_in', 'user_is_logged_in', 'user_is_logged_in (uncached)', 'user_batch',
+             'user_log_out')
+
+# time spent in each part of the current request, per thread
+spent = threading.local()
+
+
+def add_time(part, started):
+    setattr(spent, part, getattr(spent, part, 0.0) + time.perf_counter() - started)
+
+
+def timed(part, fn):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_time(part, started)
+    return wrapper
+
+
+class TimedJson:
+    """ Stands in for the json module inside lambda_function so (de)serialization gets timed """
+
+    def __init__(self):
+        self.dumps = timed('serialization', json.dumps)
+        self.loads = timed('serialization', json.loads)
+
+
+def instrument():
+    lambda_function.json = TimedJson()
+    lambda_function.password_hasher.run = timed('bcrypt', lambda_function.password_hasher.run)
+    queries.run = timed('db', queries.run)
+
+
+def post(body):
+    return {'body': json.dumps(body), 'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}}
+
+
+def get(parameters):
+    return {'queryStringParameters': parameters, 'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}}
+
+
+def seed_users(count):
+    users = []
+    for i in range(count):
+        email = 'load-test-%s@example.com' % uuid.uuid4()
+        body = json.loads(lambda_function.user_sign_up(post({'email': email, 'password': 'password',
+                                                                  'first_name': 'Load', 'last_name': 'Test'}),
+                                                            None)['body'])
+        users.append({'email': email, 'user_id': body['user_id'], 'token': body['login_token']})
+    return users
+
+
+def make_requests(endpoint, users, count, batch_size):
+    """ (handler, event, before) for each request; `before` runs untimed just ahead of it """
+    requests = []
+    for i in range(count):
+        user = users[i % len(users)]
+        if endpoint == 'user_sign_up':
+            email = 'load-test-%s@example.com' % uuid.uuid4()
+            requests.append((lambda_function.user_sign_up, post({'email': email, 'password': 'password',
+                                                                 'first_name': 'Load', 'last_name': 'Test'}), None))
+        elif endpoint == 'user_log_in':
+            requests.append((lambda_function.user_log_in, post({'email': user['email'], 'password': 'password'}),
+                             None))
+        elif endpoint == 'user_is_logged_in':
+            requests.append((lambda_function.user_is_logged_in,
+                             get({'user_id': user['user_id'], 'token': user['token']}), None))
+        elif endpoint == 'user_is_logged_in (uncached)':
+            requests.append((lambda_function.user_is_logged_in,
+                             get({'user_id': user['user_id'], 'token': user['token']}),
+                             lambda u=user: lambda_function.token_cache.invalidate(u['user_id'], u['token'])))
+        elif endpoint == 'user_batch':
+            operations = [{'op': 'is_logged_in', 'user_id': u['user_id'], 'token': u['token']}
+                          for u in random.sample(users, min(batch_size, len(users)))]
+            requests.append((lambda_function.user_batch, post({'operations': operations}), None))
+        elif endpoint == 'user_log_out':
+            requests.append((lambda_function.user_log_out,
+                             get({'user_id': user['user_id'], 'token': user['token']}), None))
+    return requests
+
+
+def call(handler, event, before):
+    if before:
+        before()
+
+    spent.__dict__.clear()
+    started = time.perf_counter()
+    try:
+        response = handler(event, None)
+        body = json.loads(response['body'])
+        ok = body.get('message_key') in (None, 'SUCCESS') and body.get('message') in (None, 'success')
+    except Exception:
+        ok = False
+    elapsed = time.perf_counter() - started
+
+    return elapsed, ok, dict(spent.__dict__)
+
+
+def percentile(values, fraction):
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def run_endpoint(endpoint, users, args):
+    requests = make_requests(endpoint, users, args.requests, args.batch_size)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(lambda request: call(*request), requests))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, ok, parts in samples)
+    breakdown = {}
+    for part in ('bcrypt', 'db', 'serialization'):
+        breakdown[part] = statistics.mean(parts.get(part, 0.0) * 1000 for elapsed, ok, parts in samples)
+    breakdown['other'] = max(0.0, statistics.mean(latencies) - sum(breakdown.values()))
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for elapsed, ok, parts in samples if not ok),
+        'throughput_rps': len(samples) / wall,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': statistics.mean(latencies),
+            'max': latencies[-1],
+        },
+        'mean_breakdown_ms': breakdown,
+    }
+
+
+def check_logged_out(users):
+    """ Logged out tokens that still pass, after the denylist reloads from the database as a cold container's would """
+    lambda_function.token_cache.clear()
+    lambda_function.denylist.next_refresh = 0
+    still_valid = 0
+    for user in users:
+        body = json.loads(lambda_function.user_is_logged_in(get({'user_id': user['user_id'], 'token': user['token']}),
+                                                            None)['body'])
+        if body.get('message') == 'success':
+            still_valid = still_valid + 1
+    return still_valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', choices=('fake', 'postgres'), default='fake')
+    parser.add_argument('--db-latency-ms', type=float, default=0.5, help="per statement, fake database only")
+    parser.add_argument('--requests', type=int, default=500, help="per endpoint")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--bcrypt-rounds', type=int, default=lambda_function.password_hasher.rounds)
+    parser.add_argument('--token-mode', choices=('database', 'signed'), default=lambda_function.TOKEN_MODE)
+    parser.add_argument('--admission', action='store_true',
+                        help="keep the ADMISSION_* limits; off by default as every request comes from one IP")
+    parser.add_argument('--endpoints', nargs='*', default=list(ENDPOINTS), choices=ENDPOINTS)
+    parser.add_argument('--output', help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.db == 'fake':
+        lambda_function.pool.connect = FakeDatabase(latency_ms=args.db_latency_ms).connect
+        # no replicas, and don't go looking for them in the secret
+        lambda_function.replica_set = lambda_function.ReplicaSet()
+    lambda_function.pool.max_size = args.concurrency
+    if not args.admission:
+        lambda_function.admission = lambda_function.Admission()
+
+    hasher = lambda_function.password_hasher
+    hasher.rounds = hasher.min_rounds = args.bcrypt_rounds
+
+    lambda_function.TOKEN_MODE = args.token_mode
+    if args.token_mode == 'signed' and 'TOKEN_SECRET' not in os.environ:
+        lambda_function.signed_tokens = lambda_function.SignedTokens(uuid.uuid4().hex,
+                                                                     lambda_function.TOKEN_EXPIRATION_DAYS * 86400)
+
+    users = seed_users(args.users)
+    instrument()
+
+    results = {}
+    # always in ENDPOINTS order, log outs spend the tokens so they go last
+    for endpoint in [e for e in ENDPOINTS if e in args.endpoints]:
+        results[endpoint] = run_endpoint(endpoint, users, args)
+
+    # every user was logged out above, so none of these should pass
+    still_valid = check_logged_out(users) if 'user_log_out' in args.endpoints else None
+
+    document = {
+        'config': {
+            'db': args.db,
+            'db_latency_ms': args.db_latency_ms if args.db == 'fake' else None,
+            'requests_per_endpoint': args.requests,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'batch_size': args.batch_size,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'token_mode': args.token_mode,
+            'admission': args.admission,
+            'replicas': [replica.name for replica in lambda_function.replicas().replicas],
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'endpoints': results,
+        'still_valid_after_log_out': still_valid,
+        'replica_reads': lambda_function.replicas().counts,
+        'admission': lambda_function.admission_stats(),
+    }
+
+    output = json.dumps(document, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
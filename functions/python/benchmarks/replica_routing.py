@@ -0,0 +1,83 @@
+""" Checks read-replica routing against a real primary and replica(s).
+
+Point DB_* at the primary and DB_REPLICA_HOSTS at the replicas (a second local instance
+works too, streaming from the first or not), then run from functions/python:
+
+    DB_HOST=localhost DB_NAME=postgres DB_REPLICA_HOSTS=localhost:5433 python -m benchmarks.replica_routing
+
+For each user it signs up, logs straight in (read after write), checks the token with the
+cache cleared (a read) and again after logging out (must fail even if a replica hasn't
+caught up). Prints the failures, where the reads went and the per-endpoint latency as JSON.
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+import lambda_function
+
+
+def call(handler, event):
+    started = time.perf_counter()
+    response = handler(event, None)
+    return json.loads(response['body']), (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--checks', type=int, default=5, help="uncached token checks per user")
+    parser.add_argument('--strategy', choices=('round_robin', 'least_latency'))
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    args = parser.parse_args()
+
+    hasher = lambda_function.password_hasher
+    hasher.rounds = hasher.min_rounds = args.bcrypt_rounds
+    replicas = lambda_function.replicas()
+    if args.strategy:
+        replicas.strategy = args.strategy
+
+    failures = []
+    timings = {'user_sign_up': [], 'user_log_in': [], 'user_is_logged_in': [], 'user_log_out': []}
+    for i in range(args.users):
+        email = 'replica-%s@example.com' % uuid.uuid4().hex
+        password = uuid.uuid4().hex
+        body, ms = call(lambda_function.user_sign_up, {'body': json.dumps(
+            {'email': email, 'password': password, 'first_name': 'Replica', 'last_name': 'Check'})})
+        timings['user_sign_up'].append(ms)
+
+        body, ms = call(lambda_function.user_log_in, {'body': json.dumps({'email': email, 'password': password})})
+        timings['user_log_in'].append(ms)
+        if body.get('message_key') != 'SUCCESS':
+            failures.append({'step': 'log in after sign up', 'email': email, 'response': body})
+            continue
+        token = {'user_id': body['user_id'], 'token': body['token']}
+
+        for check in range(args.checks):
+            lambda_function.token_cache.clear()
+            body, ms = call(lambda_function.user_is_logged_in, {'queryStringParameters': token})
+            timings['user_is_logged_in'].append(ms)
+            if body.get('message') != 'success':
+                failures.append({'step': 'check', 'token': token, 'response': body})
+
+        body, ms = call(lambda_function.user_log_out, {'queryStringParameters': token})
+        timings['user_log_out'].append(ms)
+        lambda_function.token_cache.clear()
+        body, ms = call(lambda_function.user_is_logged_in, {'queryStringParameters': token})
+        if body.get('message') == 'success':
+            failures.append({'step': 'check after log out', 'token': token, 'response': body})
+
+    print(json.dumps({
+        'replicas': [{'name': r.name, 'lag_seconds': r.lag, 'latency_ms': r.latency and r.latency * 1000}
+                     for r in replicas.replicas],
+        'strategy': replicas.strategy,
+        'reads': replicas.counts,
+        'failures': failures,
+        'latency_ms': dict((endpoint, {'p50': statistics.median(values), 'max': max(values)})
+                           for endpoint, values in timings.items() if values),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+""" Counts database round trips and time per auth endpoint against a real Postgres.
+
+Run from functions/python against a database migrated with `python -m migrations`, e.g.
+
+    DB_HOST=localhost DB_NAME=postgres python -m benchmarks.round_trips --iterations 50
+
+Round trips are counted on the client: every execute, plus the BEGIN psycopg2 sends before
+the first statement of a transaction, plus COMMIT/ROLLBACK when a transaction is open.
+Prints one JSON document.
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+import psycopg2
+import psycopg2.extensions
+
+import lambda_function
+from lambda_function import connect_with
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        conn = self.connection
+        if not conn.autocommit and conn.status == psycopg2.extensions.STATUS_READY:
+            conn.round_trips += 1  # implicit BEGIN
+        conn.round_trips += 1
+        return super(CountingCursor, self).execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super(CountingConnection, self).__init__(*args, **kwargs)
+        self.round_trips = 0
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        if self.status != psycopg2.extensions.STATUS_READY:
+            self.round_trips += 1
+        return super(CountingConnection, self).commit()
+
+    def rollback(self):
+        if self.status != psycopg2.extensions.STATUS_READY:
+            self.round_trips += 1
+        return super(CountingConnection, self).rollback()
+
+
+def counting_connect_with(creds, host=None, port=None):
+    # the DSN the handlers build, only the connection class differs
+    return connect_with(creds, host, port, connection_factory=CountingConnection)
+
+
+def call(handler, event):
+    conn = lambda_function.pool.get_conn()
+    before = conn.round_trips
+    lambda_function.pool.put_conn(conn)
+
+    started = time.perf_counter()
+    response = handler(event, None)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    conn = lambda_function.pool.get_conn()
+    round_trips = conn.round_trips - before
+    lambda_function.pool.put_conn(conn)
+
+    return json.loads(response['body']), round_trips, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    lambda_function.connect_with = counting_connect_with
+    lambda_function.pool.max_size = 1  # so every call sees the same counting connection
+    lambda_function.pool.check_after_seconds = 3600
+
+    samples = {}
+
+    def record(endpoint, result):
+        body, round_trips, elapsed_ms = result
+        entry = samples.setdefault(endpoint, {'round_trips': [], 'ms': [], 'responses': set()})
+        entry['round_trips'].append(round_trips)
+        entry['ms'].append(elapsed_ms)
+        entry['responses'].add(body.get('message_key') or body.get('message'))
+
+    for i in range(args.iterations):
+        email = 'round-trips-%s@example.com' % uuid.uuid4()
+        sign_up = {'body': json.dumps({'email': email, 'password': 'password', 'first_name': 'Round',
+                                       'last_name': 'Trip'})}
+        record('user_sign_up', call(lambda_function.user_sign_up, sign_up))
+        record('user_sign_up (existing email)', call(lambda_function.user_sign_up, sign_up))
+
+        body, round_trips, elapsed_ms = call(lambda_function.user_log_in,
+                                             {'body': json.dumps({'email': email, 'password': 'password'})})
+        record('user_log_in', (body, round_trips, elapsed_ms))
+
+        check = {'queryStringParameters': {'user_id': body['user_id'], 'token': body['token']}}
+        lambda_function.token_cache.clear()
+        record('user_is_logged_in (uncached)', call(lambda_function.user_is_logged_in, check))
+        record('user_is_logged_in (cached)', call(lambda_function.user_is_logged_in, check))
+        record('user_log_out', call(lambda_function.user_log_out, check))
+
+    print(json.dumps({
+        endpoint: {
+            'round_trips': statistics.median(entry['round_trips']),
+            'p50_ms': statistics.median(entry['ms']),
+            'responses': sorted(entry['responses']),
+        } for endpoint, entry in samples.items()
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
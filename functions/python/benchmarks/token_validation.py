@@ -0,0 +1,77 @@
+""" Compares user_is_logged_in throughput for database backed and signed tokens.
+
+Run from functions/python against a database migrated with `python -m migrations`, e.g.
+
+    DB_HOST=localhost DB_NAME=postgres python -m benchmarks.token_validation --checks 2000
+
+Three modes are measured on the same users: database tokens with the in-container cache
+cleared before every check, database tokens answered from the cache, and signed tokens.
+Prints one JSON document.
+"""
+import argparse
+import json
+import time
+import uuid
+
+import lambda_function
+
+
+def sign_up(count):
+    tokens = []
+    for i in range(count):
+        email = 'token-validation-%s@example.com' % uuid.uuid4()
+        body = json.loads(lambda_function.user_sign_up({'body': json.dumps({
+            'email': email, 'password': 'password', 'first_name': 'Token', 'last_name': 'Validation'})}, None)['body'])
+        tokens.append((body['user_id'], body['login_token']))
+    return tokens
+
+
+def measure(tokens, checks, before_check=None):
+    events = [{'queryStringParameters': {'user_id': user_id, 'token': token}} for user_id, token in tokens]
+    failures = 0
+
+    started = time.perf_counter()
+    for i in range(checks):
+        if before_check:
+            before_check()
+        response = lambda_function.user_is_logged_in(events[i % len(events)], None)
+        if json.loads(response['body']).get('message') != 'success':
+            failures = failures + 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        'checks': checks,
+        'checks_per_second': checks / elapsed,
+        'mean_us': elapsed / checks * 1000000,
+        'failures': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--checks', type=int, default=1000)
+    args = parser.parse_args()
+
+    # keep sign-up cheap, bcrypt isn't what's being measured
+    lambda_function.password_hasher.rounds = 4
+
+    results = {}
+
+    lambda_function.TOKEN_MODE = 'database'
+    tokens = sign_up(args.users)
+    results['database (uncached)'] = measure(tokens, args.checks, before_check=lambda_function.token_cache.clear)
+    results['database (cached)'] = measure(tokens, args.checks)
+
+    lambda_function.TOKEN_MODE = 'signed'
+    if lambda_function.signed_tokens is None and 'TOKEN_SECRET' not in lambda_function.os.environ:
+        lambda_function.signed_tokens = lambda_function.SignedTokens(uuid.uuid4().hex,
+                                                                     lambda_function.TOKEN_EXPIRATION_DAYS * 86400)
+    tokens = sign_up(args.users)
+    results['signed'] = measure(tokens, args.checks)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """ Keeps DB-API connections open between invocations of a warm Lambda container.
+
+    connect is any callable returning a DB-API connection, so the pool works the same
+    against psycopg2 or a fake stand-in.
+    """
+
+    def __init__(self, connect, max_size=1, wait_timeout=10, check_after_seconds=30,
+                 max_lifetime_seconds=3600, ping_sql="SELECT 1", on_connect=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.check_after_seconds = check_after_seconds
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.ping_sql = ping_sql
+        self.on_connect = on_connect
+
+        self.idle = []  # (conn, created, last_used), most recently used last
+        self.created = {}  # id(conn) -> created, for checked out connections
+        self.checked_out = 0
+        self.lock = threading.Condition()
+
+    def size(self):
+        with self.lock:
+            return len(self.idle) + self.checked_out
+
+    def get_conn(self):
+        deadline = time.monotonic() + self.wait_timeout
+
+        with self.lock:
+            while not self.idle and self.checked_out >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted("No connection available after %s seconds" % self.wait_timeout)
+                self.lock.wait(remaining)
+
+            # reserve the slot before leaving the lock so concurrent callers respect max_size
+            self.checked_out += 1
+            conn, created, last_used = self.idle.pop() if self.idle else (None, None, None)
+
+        try:
+            if conn is not None and not self.is_usable(conn, created, last_used):
+                self.close_quietly(conn)
+                conn = None
+
+            if conn is None:
+                conn = self.connect()
+                created = time.monotonic()
+                if self.on_connect:
+                    self.on_connect(conn)
+        except Exception:
+            if conn is not None:
+                self.close_quietly(conn)
+            with self.lock:
+                self.checked_out -= 1
+                self.lock.notify()
+            raise
+
+        with self.lock:
+            self.created[id(conn)] = created
+
+        return conn
+
+    def put_conn(self, conn, discard=False):
+        with self.lock:
+            created = self.created.pop(id(conn), None)
+
+        if created is None:
+            raise ValueError("Connection was not checked out from this pool")
+
+        if not discard and not getattr(conn, 'closed', False):
+            try:
+                # leave nothing half done for the next invocation
+                conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        if discard:
+            self.close_quietly(conn)
+
+        with self.lock:
+            self.checked_out -= 1
+            if not discard:
+                self.idle.append((conn, created, time.monotonic()))
+            self.lock.notify()
+
+    def is_usable(self, conn, created, last_used):
+        now = time.monotonic()
+        if getattr(conn, 'closed', False):
+            return False
+
+        if now - created > self.max_lifetime_seconds:
+            return False
+
+        if now - last_used < self.check_after_seconds:
+            return True
+
+        # idle for a while (e.g. a frozen container), the server may have dropped us
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.ping_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for conn, created, last_used in idle:
+            self.close_quietly(conn)
+
+    @staticmethod
+    def close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
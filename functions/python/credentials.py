@@ -0,0 +1,48 @@
+import json
+import os
+import threading
+import time
+
+
+class CachedCredentials:
+    """ Fetches credentials on first use and keeps them for ttl_seconds """
+
+    def __init__(self, fetch, ttl_seconds=3600):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.value = None
+        self.fetched_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.value is None or time.monotonic() - self.fetched_at >= self.ttl_seconds:
+                self.value = self.fetch()
+                self.fetched_at = time.monotonic()
+            return self.value
+
+    def invalidate(self):
+        with self.lock:
+            self.value = None
+
+
+def local_credentials():
+    """ Credentials from DB_CREDENTIALS_FILE or DB_HOST/DB_NAME/DB_USER/DB_PASSWORD, if either is set.
+
+    The file holds the same JSON as the Secrets Manager secret, so offline runs never need AWS.
+    """
+    path = os.environ.get('DB_CREDENTIALS_FILE')
+    if path:
+        with open(path) as f:
+            return json.load(f)
+
+    if os.environ.get('DB_HOST'):
+        return {
+            'host': os.environ['DB_HOST'],
+            'port': int(os.environ.get('DB_PORT', 5432)),
+            'engine': os.environ.get('DB_NAME', 'postgres'),
+            'username': os.environ.get('DB_USER', 'postgres'),
+            'password': os.environ.get('DB_PASSWORD', ''),
+        }
+
+    return None
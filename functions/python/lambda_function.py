@@ -1,14 +1,28 @@
 import json
+import logging
 import psycopg2
 import os
-import bcrypt
 import uuid
-import boto3
+import time
 import base64
-from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
+from connection_pool import ConnectionPool
+from token_cache import TokenCache
+from password_hashing import PasswordHasher, HashingBusy
+from credentials import CachedCredentials, local_credentials
+from migrations import prune_login_tokens
+from queries import Statement, fetch_one, fetch_all, execute, transaction
+from signed_tokens import SignedTokens, Denylist, MissingTokenSecret
+from replicas import Replica, ReplicaSet, parse_hosts
+from admission import Admission, source_ip
+
+logger = logging.getLogger(__name__)
 
 def retrieve_credentials():
+    # boto3 is slow to import and only needed when there's no local override
+    import boto3
+    from botocore.exceptions import ClientError
+
     secret_name = "postgres-lambda-credentials"
     region_name = "us-west-2"
 
@@ -58,48 +72,291 @@ def retrieve_credentials():
             decoded_binary_secret = base64.b64decode(get_secret_value_response['SecretBinary'])
             return json.loads(decoded_binary_secret)
 
-credentials = retrieve_credentials()
-db_host = credentials['host']
-db_port = credentials['port']
-db_name = credentials['engine']
-db_user = credentials['username']
-db_pass = credentials['password']
+def load_credentials():
+    return local_credentials() or retrieve_credentials()
+
+# fetched on the first connection rather than at import, and refreshed so rotated secrets get picked up
+credentials = CachedCredentials(load_credentials, ttl_seconds=int(os.environ.get('DB_CREDENTIALS_TTL_SECONDS', 3600)))
 TEXT_ENCODING = 'utf-8'
 TOKEN_EXPIRATION_DAYS=30
+# "database" keeps opaque tokens in login_tokens, "signed" issues self-contained HMAC signed ones
+TOKEN_MODE = os.environ.get('TOKEN_MODE', 'database')
+MAX_BATCH_OPERATIONS = int(os.environ.get('MAX_BATCH_OPERATIONS', 100))
+
+# validates the token and, only if the last write is older than %(touch_before)s, slides its expiry
+IS_LOGGED_IN_SQL = Statement('is_logged_in', "WITH valid_token AS (" \
+                                                 "SELECT login_tokens.user_id, login_tokens.token, login_tokens.last_checked_timestamp " \
+                                                 "FROM \"user\".users INNER JOIN \"user\".login_tokens ON users.user_id = login_tokens.user_id " \
+                                                 "WHERE users.user_id = %(user_id)s " \
+                                                 "AND login_tokens.token = %(token)s " \
+                                                 "AND login_tokens.is_active = true " \
+                                                 "AND login_tokens.last_checked_timestamp > %(last_checked_time)s" \
+                                             "), touched AS (" \
+                                                 "UPDATE \"user\".login_tokens SET last_checked_timestamp = %(now)s " \
+                                                 "FROM valid_token " \
+                                                 "WHERE login_tokens.user_id = valid_token.user_id " \
+                                                 "AND login_tokens.token = valid_token.token " \
+                                                 "AND valid_token.last_checked_timestamp <= %(touch_before)s " \
+                                                 "RETURNING login_tokens.last_checked_timestamp" \
+                                             ") " \
+                                             "SELECT COALESCE((SELECT last_checked_timestamp FROM touched), valid_token.last_checked_timestamp) " \
+                                             "FROM valid_token")
+
+# read-only half of IS_LOGGED_IN_SQL, for replicas: the token's last check if it's still valid
+CHECK_TOKEN_SQL = Statement('check_token', "SELECT login_tokens.last_checked_timestamp " \
+                                           "FROM \"user\".users INNER JOIN \"user\".login_tokens ON users.user_id = login_tokens.user_id " \
+                                           "WHERE users.user_id = %(user_id)s " \
+                                           "AND login_tokens.token = %(token)s " \
+                                           "AND login_tokens.is_active = true " \
+                                           "AND login_tokens.last_checked_timestamp > %(last_checked_time)s")
+
+LOG_IN_SQL = Statement('log_in', "SELECT password_encryption, user_id FROM \"user\".users WHERE email_address = %(email_address)s")
+
+CREATE_TOKEN_SQL = Statement('create_token', "INSERT INTO \"user\".login_tokens (user_id, " \
+                                                                             "token, " \
+                                                                             "created_timestamp, " \
+                                                                             "last_checked_timestamp, " \
+                                                                             "is_active) VALUES (%s, %s, %s, %s, %s)")
+
+REHASH_PASSWORD_SQL = Statement('rehash_password', "UPDATE \"user\".users SET password_encryption = %s WHERE user_id = %s")
+
+# checked before hashing so a taken email doesn't cost a bcrypt run; SIGN_UP_SQL still guards against a race
+EMAIL_EXISTS_SQL = Statement('email_exists', "SELECT 1 FROM \"user\".users WHERE email_address = %(email_address)s")
+
+# relies on the unique index on email_address; no row comes back when the email is taken
+SIGN_UP_SQL = Statement('sign_up', "WITH new_user AS (" \
+                                       "INSERT INTO \"user\".users (user_id, first_name, last_name, email_address, password_encryption) " \
+                                       "VALUES (%(user_id)s, %(first_name)s, %(last_name)s, %(email_address)s, %(password_encryption)s) " \
+                                       "ON CONFLICT (email_address) DO NOTHING " \
+                                       "RETURNING user_id" \
+                                   ") " \
+                                   "INSERT INTO \"user\".login_tokens (user_id, token, created_timestamp, last_checked_timestamp, is_active) " \
+                                   "SELECT user_id, %(token)s, %(now)s, %(now)s, true FROM new_user " \
+                                   "RETURNING user_id")
+
+LOG_OUT_SQL = Statement('log_out', "UPDATE \"user\".login_tokens " \
+                                   "SET is_active = false " \
+                                   "WHERE user_id = %(user_id)s " \
+                                   "AND token = %(token)s ")
+
+# signed token mode: only the user goes in, the token isn't stored anywhere
+SIGN_UP_USER_SQL = Statement('sign_up_user', "INSERT INTO \"user\".users (user_id, first_name, last_name, email_address, password_encryption) " \
+                                             "VALUES (%(user_id)s, %(first_name)s, %(last_name)s, %(email_address)s, %(password_encryption)s) " \
+                                             "ON CONFLICT (email_address) DO NOTHING " \
+                                             "RETURNING user_id")
+
+REVOKE_TOKEN_SQL = Statement('revoke_token', "INSERT INTO \"user\".revoked_tokens (token_id, revoked_timestamp, expires_timestamp) " \
+                                             "VALUES (%(token_id)s, %(now)s, %(expires)s) " \
+                                             "ON CONFLICT (token_id) DO NOTHING")
+
+# batch versions: the (user_id, token) pairs come in as two parallel arrays
+BATCH_IS_LOGGED_IN_SQL = Statement('batch_is_logged_in', "WITH requested AS (" \
+                                                             "SELECT DISTINCT user_id, token FROM unnest(%(user_ids)s::text[], %(tokens)s::text[]) AS r (user_id, token)" \
+                                                         "), valid_token AS (" \
+                                                             "SELECT login_tokens.user_id, login_tokens.token, login_tokens.last_checked_timestamp " \
+                                                             "FROM requested " \
+                                                             "INNER JOIN \"user\".login_tokens ON login_tokens.user_id = requested.user_id AND login_tokens.token = requested.token " \
+                                                             "INNER JOIN \"user\".users ON users.user_id = login_tokens.user_id " \
+                                                             "WHERE login_tokens.is_active = true " \
+                                                             "AND login_tokens.last_checked_timestamp > %(last_checked_time)s" \
+                                                         "), touched AS (" \
+                                                             "UPDATE \"user\".login_tokens SET last_checked_timestamp = %(now)s " \
+                                                             "FROM valid_token " \
+                                                             "WHERE login_tokens.user_id = valid_token.user_id " \
+                                                             "AND login_tokens.token = valid_token.token " \
+                                                             "AND valid_token.last_checked_timestamp <= %(touch_before)s " \
+                                                             "RETURNING login_tokens.user_id, login_tokens.token, login_tokens.last_checked_timestamp" \
+                                                         ") " \
+                                                         "SELECT valid_token.user_id, valid_token.token, " \
+                                                         "COALESCE(touched.last_checked_timestamp, valid_token.last_checked_timestamp) " \
+                                                         "FROM valid_token LEFT JOIN touched " \
+                                                         "ON touched.user_id = valid_token.user_id AND touched.token = valid_token.token")
+
+BATCH_LOG_OUT_SQL = Statement('batch_log_out', "UPDATE \"user\".login_tokens " \
+                                               "SET is_active = false " \
+                                               "FROM unnest(%(user_ids)s::text[], %(tokens)s::text[]) AS r (user_id, token) " \
+                                               "WHERE login_tokens.user_id = r.user_id " \
+                                               "AND login_tokens.token = r.token " \
+                                               "RETURNING login_tokens.user_id, login_tokens.token")
+
+BATCH_REVOKE_TOKENS_SQL = Statement('batch_revoke_tokens', "INSERT INTO \"user\".revoked_tokens (token_id, revoked_timestamp, expires_timestamp) " \
+                                                           "SELECT token_id, %(now)s, expires " \
+                                                           "FROM unnest(%(token_ids)s::text[], %(expires)s::timestamp[]) AS r (token_id, expires) " \
+                                                           "ON CONFLICT (token_id) DO NOTHING")
+
+REVOKED_SINCE_SQL = Statement('revoked_since', "SELECT token_id, revoked_timestamp, expires_timestamp FROM \"user\".revoked_tokens " \
+                                               "WHERE revoked_timestamp > %(since)s " \
+                                               "AND expires_timestamp > %(now)s")
+
+# takes a token from every bucket or from none; the ids of the buckets that were empty
+TAKE_ADMISSION_SQL = Statement('take_admission', "SELECT bucket_id FROM \"user\".take_admission_tokens(" \
+                                                 "%(bucket_ids)s::text[], %(bursts)s::float8[], %(per_seconds)s::float8[], %(now)s)")
+
+def connect_with(creds, host=None, port=None, connection_factory=None):
+    dsn = "dbname='%s' user='%s' host='%s' password='%s'" % (creds['engine'], creds['username'],
+                                                             host or creds['host'], creds['password'])
+    port = port or creds.get('port')
+    if port:
+        dsn = dsn + " port='%s'" % port
+    return psycopg2.connect(dsn, connection_factory=connection_factory)
+
+def make_conn(host=None, port=None):
+    """ A connection to the primary, or with host (and port) to a replica using the same credentials """
+    try:
+        conn = connect_with(credentials.get(), host, port)
+    except psycopg2.OperationalError:
+        # the secret may have been rotated since we cached it
+        credentials.invalidate()
+        conn = connect_with(credentials.get(), host, port)
+
+    # most handler flows are a single statement, so skip the extra BEGIN/COMMIT round trips;
+    # anything needing more than one uses queries.transaction
+    conn.autocommit = True
+    return conn
+
+# lives as long as the container does, so warm invocations skip the connection handshake
+pool = ConnectionPool(make_conn,
+                      max_size=int(os.environ.get('DB_POOL_SIZE', 1)),
+                      check_after_seconds=int(os.environ.get('DB_POOL_CHECK_AFTER_SECONDS', 30)),
+                      max_lifetime_seconds=int(os.environ.get('DB_POOL_MAX_LIFETIME_SECONDS', 3600)))
+
+# the frontend polls user_is_logged_in, so repeat checks are answered from memory
+token_cache = TokenCache(max_size=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)),
+                         ttl_seconds=int(os.environ.get('TOKEN_CACHE_TTL_SECONDS', 60)),
+                         touch_interval_seconds=int(os.environ.get('LAST_CHECKED_WRITE_INTERVAL_SECONDS', 300)))
+
+# bcrypt cost slows things down making things more secure, so it is tuned per deployment
+password_hasher = PasswordHasher(rounds=int(os.environ.get('BCRYPT_ROUNDS', 10)),
+                                 min_rounds=int(os.environ.get('BCRYPT_MIN_ROUNDS', 10)),
+                                 max_workers=int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1)),
+                                 max_pending=int(os.environ.get('BCRYPT_MAX_PENDING', 8)),
+                                 queue_timeout=float(os.environ.get('BCRYPT_QUEUE_TIMEOUT_SECONDS', 1)))
+if os.environ.get('BCRYPT_TARGET_MS'):
+    password_hasher.calibrate(float(os.environ['BCRYPT_TARGET_MS']))
+
+def take_admission_tokens(buckets, now):
+    conn = pool.get_conn()
+    try:
+        rows = fetch_all(conn, TAKE_ADMISSION_SQL, {"bucket_ids": [bucket_id for bucket_id, burst, per_second in buckets],
+                                                    "bursts": [burst for bucket_id, burst, per_second in buckets],
+                                                    "per_seconds": [per_second for bucket_id, burst, per_second in buckets],
+                                                    "now": datetime.fromtimestamp(now)})
+    finally:
+        pool.put_conn(conn)
+    return set(row[0] for row in rows)
+
+def admission_limit(name, burst, per_minute):
+    # e.g. ADMISSION_LOG_IN_IP_BURST and ADMISSION_LOG_IN_IP_PER_MINUTE; a burst of 0 turns that limit off
+    return (float(os.environ.get('ADMISSION_%s_BURST' % name, burst)),
+            float(os.environ.get('ADMISSION_%s_PER_MINUTE' % name, per_minute)))
+
+# every attempt otherwise costs a bcrypt run, so floods are turned away per source IP and per email first;
+# buckets are per container unless ADMISSION_STORE=database shares them through "user".admission_buckets
+admission = Admission({('log_in', 'ip'): admission_limit('LOG_IN_IP', 30, 10),
+                       ('log_in', 'email'): admission_limit('LOG_IN_EMAIL', 10, 5),
+                       ('sign_up', 'ip'): admission_limit('SIGN_UP_IP', 10, 2),
+                       ('sign_up', 'email'): admission_limit('SIGN_UP_EMAIL', 3, 1)},
+                      take_shared=take_admission_tokens if os.environ.get('ADMISSION_STORE') == 'database' else None,
+                      max_size=int(os.environ.get('ADMISSION_CACHE_SIZE', 10000)),
+                      retry_after_seconds=float(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', 30)),
+                      report_seconds=float(os.environ.get('ADMISSION_REPORT_SECONDS', 60)))
+
+def admission_stats():
+    """ What admission has turned away, with the bcrypt time that saved at this container's average """
+    shed = admission.shed()
+    mean_hash_seconds = password_hasher.mean_hash_seconds()
+    return {'by_action': admission.counts,
+            'hashes_shed': shed,
+            'hash_seconds_shed': None if mean_hash_seconds is None else shed * mean_hash_seconds,
+            'shared_store_errors': admission.shared_errors}
+
+def turned_away(action, event, email):
+    rejected = admission.rejected_by(action, ip=source_ip(event), email=email)
+    if rejected is not None and admission.report_due():
+        # one JSON line per ADMISSION_REPORT_SECONDS while shedding, for a CloudWatch metric filter to read
+        logger.warning("Admission shedding: %s", json.dumps(admission_stats()))
+    return rejected is not None
+
+replica_set = None
+
+def replicas():
+    """ Read replicas from DB_REPLICA_HOSTS, or the secret's replica_hosts, made on first use like the primary's credentials """
+    global replica_set
+    if replica_set is None:
+        hosts = os.environ.get('DB_REPLICA_HOSTS')
+        if hosts is None:
+            hosts = credentials.get().get('replica_hosts')
+        members = []
+        for host, port in parse_hosts(hosts):
+            def connect(host=host, port=port):
+                conn = make_conn(host, port)
+                # a write sent here by mistake fails instead of going unnoticed
+                conn.readonly = True
+                return conn
+            members.append(Replica(host if port is None else "%s:%s" % (host, port),
+                                   ConnectionPool(connect,
+                                                  max_size=pool.max_size,
+                                                  check_after_seconds=pool.check_after_seconds,
+                                                  max_lifetime_seconds=pool.max_lifetime_seconds)))
+        replica_set = ReplicaSet(members,
+                                 strategy=os.environ.get('DB_REPLICA_STRATEGY', 'round_robin'),
+                                 max_lag_seconds=float(os.environ.get('DB_REPLICA_MAX_LAG_SECONDS', 5)),
+                                 lag_check_seconds=float(os.environ.get('DB_REPLICA_LAG_CHECK_SECONDS', 10)),
+                                 retry_after_seconds=float(os.environ.get('DB_REPLICA_RETRY_AFTER_SECONDS', 30)))
+    return replica_set
+
+signed_tokens = None
+
+def token_signer():
+    global signed_tokens
+    if signed_tokens is None:
+        secret = os.environ.get('TOKEN_SECRET') or credentials.get().get('token_secret')
+        if not secret:
+            raise MissingTokenSecret("TOKEN_MODE is signed but neither TOKEN_SECRET nor the secret's token_secret is set")
+        signed_tokens = SignedTokens(secret, TOKEN_EXPIRATION_DAYS * 24 * 60 * 60)
+    return signed_tokens
+
+def load_revoked_tokens(conn, since):
+    # overlap the last fetch a little so a revocation committed out of timestamp order isn't missed
+    since = since - timedelta(minutes=1) if since else datetime(1970, 1, 1)
+    return fetch_all(conn, REVOKED_SINCE_SQL, {"since": since, "now": datetime.now()})
+
+# logged out signed tokens; refreshed from the database at most every DENYLIST_REFRESH_SECONDS
+denylist = Denylist(load_revoked_tokens, refresh_seconds=int(os.environ.get('DENYLIST_REFRESH_SECONDS', 30)))
+
+def signed_token_is_valid(user_id, token):
+    verified = token_signer().verify(user_id, token)
+    if verified is None:
+        return False
+
+    if denylist.needs_refresh():
+        conn = pool.get_conn()
+        try:
+            denylist.refresh(conn)
+        finally:
+            pool.put_conn(conn)
+
+    return verified[0] not in denylist
+
+def non_string_parameters(body, names):
+    # bodies are JSON, so anything could come in where the handlers expect text
+    return ["%s must be a string" % name for name in names if name in body and not isinstance(body[name], str)]
+
+def missing_token_parameters(body):
+    error_messages = []
+    for name in ('user_id', 'token'):
+        if name not in body:
+            error_messages.append("%s parameter not detected" % name)
+        elif not isinstance(body[name], str):
+            # batch bodies are JSON, where a list or number would otherwise reach the cache and the ::text[] casts
+            error_messages.append("%s must be a string" % name)
 
-def make_conn():
-    return psycopg2.connect("dbname='%s' user='%s' host='%s' password='%s'" % (db_name, db_user, db_host, db_pass))
-
-def fetch_data(conn, query, parameters = {}):
-    result = []
-    print("Now executing: %s" % (query))
-    cursor = conn.cursor()
-    cursor.execute(query, parameters)
-
-    raw = cursor.fetchall()
-    for line in raw:
-        result.append(line)
-
-    return result
-
-def update_data(conn, sql, record):
-    print("Now executing: %s" % (sql))
-    cursor = conn.cursor()
-    cursor.execute(sql, record)
-
-    conn.commit()
-
-    return cursor.rowcount
+    return error_messages
 
 def user_is_logged_in(event, context):
     body = event['queryStringParameters'] # query string parameters because this is a get
 
-    error_messages = []
-    if 'user_id' not in body:
-        error_messages.append("user_id parameter not detected")
-
-    if 'token' not in body:
-        error_messages.append("token parameter not detected")
+    error_messages = missing_token_parameters(body)
 
     if error_messages:
         return {
@@ -110,50 +367,78 @@ def user_is_logged_in(event, context):
 
     user_id = body['user_id']
     token = body['token']
-    earliest_last_check = datetime.now() - timedelta(days=TOKEN_EXPIRATION_DAYS)
-    conn = make_conn()
 
-    try:
-        select_sql = "select * from \"user\".users inner join \"user\".login_tokens on users.user_id = login_tokens.user_id " \
-              "WHERE users.user_id = %(user_id)s " \
-              "AND token = %(token)s " \
-              "AND is_active = true " \
-              "AND login_tokens.last_checked_timestamp > %(last_checked_time)s"
+    if TOKEN_MODE == 'signed':
+        if signed_token_is_valid(user_id, token):
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'success'}),
+            }
+        else:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message_key': 'INVALID_TOKEN'})
+            }
+
+    if token_cache.is_valid(user_id, token) and not token_cache.needs_touch(user_id, token):
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'success'}),
+        }
+
+    now = datetime.now()
+    earliest_last_check = now - timedelta(days=TOKEN_EXPIRATION_DAYS)
+    # the sliding expiry only needs writing once per window, not on every poll
+    touch_before = now - timedelta(seconds=token_cache.touch_interval_seconds)
+
+    # a replica can answer unless the check is due a write; it knowing nothing of the token isn't final
+    row = replicas().fetch_one(CHECK_TOKEN_SQL, {"user_id": user_id,
+                                                 "token": token,
+                                                 "last_checked_time": earliest_last_check},
+                               key=('token', user_id, token))
+    if row is not None and row[0] > touch_before:
+        token_cache.remember(user_id, token, last_touched=time.time() - (now - row[0]).total_seconds())
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'success'}),
+        }
 
-        result = fetch_data(conn, select_sql, {"user_id": user_id,
-                                        "token": token,
-                                        "last_checked_time": earliest_last_check})
+    conn = pool.get_conn()
 
-        if not result:
+    try:
+        row = fetch_one(conn, IS_LOGGED_IN_SQL, {"user_id": user_id,
+                                                 "token": token,
+                                                 "last_checked_time": earliest_last_check,
+                                                 "touch_before": touch_before,
+                                                 "now": now})
+
+        if row is None:
+            token_cache.invalidate(user_id, token)
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message_key': 'INVALID_TOKEN'})
             }
         else:
-            update_sql = "UPDATE \"user\".login_tokens SET last_checked_timestamp = %s " \
-                         "WHERE user_id = %s AND token = %s"
-
-            update_data(conn, update_sql, (datetime.now(), user_id, token))
+            last_checked = row[0]
+            token_cache.remember(user_id, token, last_touched=time.time() - (now - last_checked).total_seconds())
 
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'success'}),
             }
     finally:
-        conn.close()
+        pool.put_conn(conn)
 
 
 def create_token(conn, user_id):
+    if TOKEN_MODE == 'signed':
+        return token_signer().issue(user_id)
+
     login_token = str(uuid.uuid4())
     login_timestamp = datetime.now()  # let's use the server timestamp so we don't need to worry about DB time
     login_record = (user_id, login_token, login_timestamp, login_timestamp, True)
-    login_create_sql = "INSERT INTO \"user\".login_tokens (user_id, " \
-                                                          "token, " \
-                                                          "created_timestamp, " \
-                                                          "last_checked_timestamp, " \
-                                                          "is_active) VALUES (%s, %s, %s, %s, %s)"
 
-    update_data(conn, login_create_sql, login_record)
+    execute(conn, CREATE_TOKEN_SQL, login_record)
 
     return login_token
 
@@ -167,6 +452,8 @@ def user_log_in(event, context):
     if 'password' not in body:
         error_messages.append("password parameter not detected")
 
+    error_messages.extend(non_string_parameters(body, ('email', 'password')))
+
     if error_messages:
         return {
             'statusCode': 200,
@@ -177,29 +464,51 @@ def user_log_in(event, context):
     email = body['email']
     password = body['password']
 
-    conn = make_conn()
+    if turned_away('log_in', event, email):
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'TOO_MANY_ATTEMPTS'})
+        }
+
+    # only the token write needs the primary; it's also asked when a replica hasn't got the user (yet)
+    row = replicas().fetch_one(LOG_IN_SQL, {"email_address": email})
+    conn = pool.get_conn()
 
     try:
-        result = fetch_data(conn, "select password_encryption, user_id from \"user\".users where email_address = %(email_address)s",
-                            {"email_address": email})
+        if row is None:
+            row = fetch_one(conn, LOG_IN_SQL, {"email_address": email})
 
-        if not result:
+        if row is None:
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message_key': 'SECURITY_CHECK_FAILED'})
             }
 
-        password_encryption = result[0][0].tobytes() # only entry from first row
-        if not bcrypt.checkpw(password.encode(TEXT_ENCODING), password_encryption):
+        password_encryption = row[0].tobytes()
+        password_b = password.encode(TEXT_ENCODING)
+        if not password_hasher.check(password_b, password_encryption):
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message_key': 'SECURITY_CHECK_FAILED'})
             }
 
-        user_id = result[0][1]
+        user_id = row[1]
 
-        # Success! Create a new token
-        login_token = create_token(conn, user_id)
+        # we only ever see the plain password here, so this is where old-cost hashes get upgraded
+        new_password_encryption = None
+        if password_hasher.needs_rehash(password_encryption):
+            try:
+                new_password_encryption = password_hasher.hash(password_b)
+            except HashingBusy:
+                pass  # the password checked out; the upgrade can wait for a quieter log-in
+
+        if new_password_encryption is not None:
+            with transaction(conn):
+                execute(conn, REHASH_PASSWORD_SQL, (new_password_encryption, user_id))
+                login_token = create_token(conn, user_id)
+        else:
+            # Success! Create a new token
+            login_token = create_token(conn, user_id)
 
         return {
             'statusCode': 200,
@@ -208,8 +517,13 @@ def user_log_in(event, context):
                                 'user_id': user_id
                                 })
         }
+    except HashingBusy:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'SERVICE_BUSY'})
+        }
     finally:
-        conn.close()
+        pool.put_conn(conn)
 
 def user_sign_up(event, context):
     body = json.loads(event['body'])
@@ -227,6 +541,8 @@ def user_sign_up(event, context):
     if 'last_name' not in body:
         error_messages.append("last name not detected")
 
+    error_messages.extend(non_string_parameters(body, ('email', 'password', 'first_name', 'last_name')))
+
     if error_messages:
         return {
             'statusCode': 200,
@@ -258,12 +574,16 @@ def user_sign_up(event, context):
                                 'message': ",".join(error_messages)})
         }
 
-    conn = make_conn()
+    if turned_away('sign_up', event, email):
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'TOO_MANY_ATTEMPTS'})
+        }
+
+    conn = pool.get_conn()
 
     try:
-        result = fetch_data(conn, "select * from \"user\".users where email_address = %(email_address)s",
-                            {"email_address": email})
-        if result:
+        if fetch_one(conn, EMAIL_EXISTS_SQL, {"email_address": email}) is not None:
             return {
                 'statusCode': 200,
                 'body': json.dumps({
@@ -271,18 +591,33 @@ def user_sign_up(event, context):
                 })
             }
 
-        rounds_of_hashing = 10 # slows things down making things more secure
-        salt = bcrypt.gensalt(rounds=rounds_of_hashing)
         password_b = password.encode(TEXT_ENCODING)
-        password_encryption = bcrypt.hashpw(password_b, salt)
+        password_encryption = password_hasher.hash(password_b)
         user_id = str(uuid.uuid4())
-        user_record = (user_id, first_anme, last_name, email, password_encryption)
-        user_create_sql = "INSERT INTO \"user\".users (user_id, first_name, last_name, email_address, password_encryption) " \
-                          "VALUES (%s, %s, %s, %s, %s)"
 
-        update_data(conn, user_create_sql, user_record)
-
-        login_token = create_token(conn, user_id)
+        if TOKEN_MODE == 'signed':
+            login_token = token_signer().issue(user_id)
+            sign_up_sql = SIGN_UP_USER_SQL
+        else:
+            login_token = str(uuid.uuid4())
+            sign_up_sql = SIGN_UP_SQL
+
+        # user and first token go in together, and the unique email check happens in the same statement
+        row = fetch_one(conn, sign_up_sql, {"user_id": user_id,
+                                            "first_name": first_anme,
+                                            "last_name": last_name,
+                                            "email_address": email,
+                                            "password_encryption": password_encryption,
+                                            "token": login_token,
+                                            "now": datetime.now()})
+
+        if row is None:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message_key': 'USER_ALREADY_EXISTS'
+                })
+            }
 
         return {
                 'statusCode': 200,
@@ -292,19 +627,19 @@ def user_sign_up(event, context):
                     'login_token': login_token
                 })
         }
+    except HashingBusy:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'SERVICE_BUSY'})
+        }
     finally:
-        conn.close()
+        pool.put_conn(conn)
 
 def user_log_out(event, context):
     body = event['queryStringParameters']  # query string parameters because this is a get
     # body = {}
 
-    error_messages = []
-    if 'user_id' not in body:
-        error_messages.append("user_id parameter not detected")
-
-    if 'token' not in body:
-        error_messages.append("token parameter not detected")
+    error_messages = missing_token_parameters(body)
 
     if error_messages:
         return {
@@ -317,16 +652,20 @@ def user_log_out(event, context):
     user_id = body['user_id']
     token = body['token']
 
-    try:
-        conn = make_conn()
+    if TOKEN_MODE == 'signed':
+        return signed_token_log_out(user_id, token)
 
-        update_sql = "UPDATE \"user\".login_tokens " \
-              "SET is_active = false " \
-              "WHERE user_id = %(user_id)s " \
-              "AND token = %(token)s "
+    token_cache.invalidate(user_id, token)
+    # until replicas have the log out too, checks of this token go to the primary
+    replicas().wrote(('token', user_id, token))
+    conn = pool.get_conn()
 
-        row_count = update_data(conn, update_sql, {"user_id": user_id,
-                                        "token": token})
+    try:
+        row_count = execute(conn, LOG_OUT_SQL, {"user_id": user_id,
+                                                "token": token})
+
+        # a check that was in flight during the update may have cached the token again
+        token_cache.invalidate(user_id, token)
 
         if row_count == 0:
             return {
@@ -339,4 +678,185 @@ def user_log_out(event, context):
                 'body': json.dumps({'message': 'success'}),
             }
     finally:
-        conn.close()
+        pool.put_conn(conn)
+
+def signed_token_log_out(user_id, token):
+    verified = token_signer().verify(user_id, token)
+    if verified is None:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'INVALID_TOKEN_OR_USER_ID'})
+        }
+
+    token_id, seconds_left = verified
+    now = datetime.now()
+    conn = pool.get_conn()
+
+    try:
+        # it only has to stay on the denylist until it would have expired anyway
+        execute(conn, REVOKE_TOKEN_SQL, {"token_id": token_id,
+                                         "now": now,
+                                         "expires": now + timedelta(seconds=seconds_left)})
+        denylist.add(token_id, now + timedelta(seconds=seconds_left))
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'success'}),
+        }
+    finally:
+        pool.put_conn(conn)
+
+def user_batch(event, context):
+    """ Several is_logged_in / log_out operations in one invocation, sharing one connection.
+
+    The body is {"operations": [{"op": "is_logged_in" or "log_out", "user_id": ..., "token": ...}, ...]}
+    and results come back in the same order, each shaped like the single endpoint's body. Log outs
+    are applied before checks, so checking a token logged out in the same batch fails.
+    """
+    body = json.loads(event['body'])
+    operations = body.get('operations') if isinstance(body, dict) else None
+
+    if not isinstance(operations, list) or not operations:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'INVALID_REQUEST',
+                                'message': "operations parameter not detected"})
+        }
+
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message_key': 'INVALID_REQUEST',
+                                'message': "at most %s operations per batch" % MAX_BATCH_OPERATIONS})
+        }
+
+    results = [None] * len(operations)
+    checks = []
+    log_outs = []
+
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in ('is_logged_in', 'log_out'):
+            results[i] = {'message_key': 'INVALID_REQUEST',
+                          'message': "op must be is_logged_in or log_out"}
+            continue
+
+        error_messages = missing_token_parameters(operation)
+        if error_messages:
+            results[i] = {'message_key': 'INVALID_REQUEST',
+                          'message': ",".join(error_messages)}
+        elif operation['op'] == 'log_out':
+            log_outs.append((i, operation['user_id'], operation['token']))
+        else:
+            checks.append((i, operation['user_id'], operation['token']))
+
+    if TOKEN_MODE == 'signed':
+        batch_signed_tokens(checks, log_outs, results)
+    else:
+        batch_database_tokens(checks, log_outs, results)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message_key': 'SUCCESS',
+                            'results': results})
+    }
+
+def batch_database_tokens(checks, log_outs, results):
+    logged_out = set((user_id, token) for i, user_id, token in log_outs)
+    unchecked = []
+    for i, user_id, token in checks:
+        if (user_id, token) in logged_out:
+            continue  # answered from the log out below
+        elif token_cache.is_valid(user_id, token) and not token_cache.needs_touch(user_id, token):
+            results[i] = {'message': 'success'}
+        else:
+            unchecked.append((i, user_id, token))
+
+    if not log_outs and not unchecked:
+        return
+
+    now = datetime.now()
+    conn = pool.get_conn()
+
+    try:
+        if log_outs:
+            rows = fetch_all(conn, BATCH_LOG_OUT_SQL, {"user_ids": [user_id for i, user_id, token in log_outs],
+                                                       "tokens": [token for i, user_id, token in log_outs]})
+            found = set(rows)
+            for i, user_id, token in log_outs:
+                token_cache.invalidate(user_id, token)
+                replicas().wrote(('token', user_id, token))
+                if (user_id, token) in found:
+                    results[i] = {'message': 'success'}
+                else:
+                    results[i] = {'message_key': 'INVALID_TOKEN_OR_USER_ID'}
+
+        if unchecked:
+            rows = fetch_all(conn, BATCH_IS_LOGGED_IN_SQL, {
+                "user_ids": [user_id for i, user_id, token in unchecked],
+                "tokens": [token for i, user_id, token in unchecked],
+                "last_checked_time": now - timedelta(days=TOKEN_EXPIRATION_DAYS),
+                "touch_before": now - timedelta(seconds=token_cache.touch_interval_seconds),
+                "now": now})
+            last_checked = dict(((user_id, token), checked) for user_id, token, checked in rows)
+
+            for i, user_id, token in unchecked:
+                if (user_id, token) in last_checked:
+                    age = (now - last_checked[(user_id, token)]).total_seconds()
+                    token_cache.remember(user_id, token, last_touched=time.time() - age)
+                    results[i] = {'message': 'success'}
+                else:
+                    token_cache.invalidate(user_id, token)
+                    results[i] = {'message_key': 'INVALID_TOKEN'}
+    finally:
+        pool.put_conn(conn)
+
+    for i, user_id, token in checks:
+        if results[i] is None:
+            results[i] = {'message_key': 'INVALID_TOKEN'}
+
+def batch_signed_tokens(checks, log_outs, results):
+    now = datetime.now()
+    revoked = {}
+
+    for i, user_id, token in log_outs:
+        verified = token_signer().verify(user_id, token)
+        if verified is None:
+            results[i] = {'message_key': 'INVALID_TOKEN_OR_USER_ID'}
+        else:
+            token_id, seconds_left = verified
+            revoked[token_id] = now + timedelta(seconds=seconds_left)
+            results[i] = {'message': 'success'}
+
+    if revoked:
+        conn = pool.get_conn()
+        try:
+            execute(conn, BATCH_REVOKE_TOKENS_SQL, {"token_ids": list(revoked),
+                                                    "expires": list(revoked.values()),
+                                                    "now": now})
+        finally:
+            pool.put_conn(conn)
+
+        for token_id, expires in revoked.items():
+            denylist.add(token_id, expires)
+
+    for i, user_id, token in checks:
+        if signed_token_is_valid(user_id, token):
+            results[i] = {'message': 'success'}
+        else:
+            results[i] = {'message_key': 'INVALID_TOKEN'}
+
+def user_prune_tokens(event, context):
+    # run on a schedule so login_tokens doesn't grow forever
+    conn = pool.get_conn()
+
+    try:
+        deleted = prune_login_tokens(conn, TOKEN_EXPIRATION_DAYS,
+                                     batch_size=int(os.environ.get('PRUNE_BATCH_SIZE', 5000)))
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'success',
+                                'deleted': deleted}),
+        }
+    finally:
+        pool.put_conn(conn)
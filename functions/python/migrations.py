@@ -0,0 +1,273 @@
+""" Versioned schema for the "user" tables the auth handlers use.
+
+Apply with `python -m migrations` from functions/python (credentials come from the same
+place as the handlers), or call migrate(conn). Each migration runs in its own transaction, or
+statement by statement when it builds indexes concurrently, and is recorded in
+"user".schema_migrations, so running it again only applies what's new.
+"""
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# (version, description, sql), append only once released - never edit one a deployed database may have
+# applied. sql is one string run in a transaction, or a list of statements run one at a time outside one
+# (for CREATE INDEX CONCURRENTLY)
+MIGRATIONS = [
+    (1, "users and login_tokens tables", """
+        CREATE SCHEMA IF NOT EXISTS "user";
+
+        CREATE TABLE IF NOT EXISTS "user".users (
+            user_id text PRIMARY KEY,
+            first_name text NOT NULL,
+            last_name text NOT NULL,
+            email_address text NOT NULL,
+            password_encryption bytea NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS "user".login_tokens (
+            user_id text NOT NULL REFERENCES "user".users (user_id),
+            token text NOT NULL,
+            created_timestamp timestamp NOT NULL,
+            last_checked_timestamp timestamp NOT NULL,
+            is_active boolean NOT NULL DEFAULT true
+        );
+    """),
+    # a list: these run outside a transaction so the indexes build CONCURRENTLY, without blocking writes
+    (2, "indexes for the handler queries", [
+        # tables from before migrations may hold duplicates from the old check-then-insert sign-up
+        """DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM "user".users GROUP BY email_address HAVING count(*) > 1) THEN
+                RAISE EXCEPTION 'Duplicate email addresses in "user".users, the unique index can''t be built'
+                    USING HINT = 'Merge or remove them first; SELECT email_address, array_agg(user_id) '
+                                 'FROM "user".users GROUP BY email_address HAVING count(*) > 1 lists them';
+            END IF;
+        END $$""",
+
+        # user_log_in lookup, and the ON CONFLICT arbiter for user_sign_up
+        """CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_address_idx ON "user".users (email_address)""",
+
+        # user_is_logged_in and user_log_out
+        """CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS login_tokens_user_id_token_idx
+            ON "user".login_tokens (user_id, token)""",
+
+        # prune_login_tokens: one index per side of its OR, combined with a BitmapOr
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS login_tokens_last_checked_idx
+            ON "user".login_tokens (last_checked_timestamp)""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS login_tokens_logged_out_idx
+            ON "user".login_tokens (last_checked_timestamp) WHERE is_active = false""",
+    ]),
+    (3, "denylist for logged out signed tokens", """
+        CREATE TABLE IF NOT EXISTS "user".revoked_tokens (
+            token_id text PRIMARY KEY,
+            revoked_timestamp timestamp NOT NULL,
+            expires_timestamp timestamp NOT NULL
+        );
+
+        -- containers only fetch what was revoked since their last refresh
+        CREATE INDEX IF NOT EXISTS revoked_tokens_revoked_idx ON "user".revoked_tokens (revoked_timestamp);
+        CREATE INDEX IF NOT EXISTS revoked_tokens_expires_idx ON "user".revoked_tokens (expires_timestamp);
+    """),
+    (4, "shared token buckets for log-in and sign-up admission", """
+        -- bucket_id is a digest of what's limited; full_timestamp is when it will have refilled to its burst
+        CREATE TABLE IF NOT EXISTS "user".admission_buckets (
+            bucket_id text PRIMARY KEY,
+            tokens double precision NOT NULL,
+            burst double precision NOT NULL,
+            per_second double precision NOT NULL,
+            updated_timestamp timestamp NOT NULL,
+            full_timestamp timestamp NOT NULL
+        );
+
+        -- prune_login_tokens deletes buckets that are full again
+        CREATE INDEX IF NOT EXISTS admission_buckets_full_idx ON "user".admission_buckets (full_timestamp);
+
+        -- returns the buckets that were empty; tokens only come out of the others when there are none
+        CREATE OR REPLACE FUNCTION "user".take_admission_tokens(ids text[], bursts float8[], per_seconds float8[],
+                                                               at timestamp)
+        RETURNS TABLE (bucket_id text) LANGUAGE plpgsql AS $$
+        BEGIN
+            -- rows are inserted and locked in bucket_id order, so two attempts sharing buckets can't deadlock
+            INSERT INTO "user".admission_buckets AS b (bucket_id, tokens, burst, per_second, updated_timestamp,
+                                                      full_timestamp)
+            SELECT r.id, r.burst, r.burst, r.per_second, at, at
+            FROM unnest(ids, bursts, per_seconds) AS r (id, burst, per_second)
+            ORDER BY r.id
+            ON CONFLICT ON CONSTRAINT admission_buckets_pkey DO NOTHING;
+
+            PERFORM 1 FROM "user".admission_buckets AS b WHERE b.bucket_id = ANY(ids) ORDER BY b.bucket_id FOR UPDATE;
+
+            RETURN QUERY
+            WITH refilled AS (
+                SELECT b.bucket_id, r.burst, r.per_second,
+                       LEAST(r.burst, b.tokens + GREATEST(0, EXTRACT(EPOCH FROM at - b.updated_timestamp)::float8) * r.per_second) AS tokens,
+                       GREATEST(b.updated_timestamp, at) AS updated
+                FROM "user".admission_buckets AS b
+                INNER JOIN unnest(ids, bursts, per_seconds) AS r (id, burst, per_second) ON b.bucket_id = r.id
+            ), taken AS (
+                SELECT refilled.*, refilled.tokens - CASE WHEN bool_and(refilled.tokens >= 1) OVER () THEN 1 ELSE 0 END AS left_over
+                FROM refilled
+            ), updated AS (
+                UPDATE "user".admission_buckets AS b
+                SET tokens = taken.left_over,
+                    burst = taken.burst,
+                    per_second = taken.per_second,
+                    updated_timestamp = taken.updated,
+                    full_timestamp = CASE WHEN taken.per_second > 0
+                                          THEN taken.updated + make_interval(secs => (taken.burst - taken.left_over) / taken.per_second)
+                                          ELSE 'infinity' END
+                FROM taken
+                WHERE b.bucket_id = taken.bucket_id
+                RETURNING b.bucket_id, taken.tokens < 1 AS empty
+            )
+            SELECT updated.bucket_id FROM updated WHERE updated.empty;
+        END
+        $$;
+    """),
+]
+
+# arbitrary, shared by everything that runs migrations so two deploys can't apply them at once
+MIGRATION_LOCK_ID = 7310021
+
+
+def applied_versions(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS \"user\"")
+        cursor.execute("CREATE TABLE IF NOT EXISTS \"user\".schema_migrations ("
+                       "version integer PRIMARY KEY, "
+                       "description text NOT NULL, "
+                       "applied_timestamp timestamp NOT NULL DEFAULT now())")
+        cursor.execute("SELECT version FROM \"user\".schema_migrations")
+        return set(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def drop_invalid_indexes(cursor):
+    """ A CONCURRENTLY build that failed leaves an invalid index behind, which IF NOT EXISTS would keep """
+    cursor.execute("SELECT c.relname FROM pg_index i "
+                   "JOIN pg_class c ON c.oid = i.indexrelid "
+                   "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                   "WHERE n.nspname = 'user' AND NOT i.indisvalid")
+    for (name,) in cursor.fetchall():
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS \"user\".\"%s\"" % name)
+
+
+def apply_statements(conn, cursor, version, description, statements):
+    """ Runs a list migration with autocommit, holding the lock for the session instead of a transaction """
+    conn.autocommit = True
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute("SELECT 1 FROM \"user\".schema_migrations WHERE version = %s", (version,))
+        if cursor.fetchone():
+            return False
+
+        drop_invalid_indexes(cursor)
+        for sql in statements:
+            cursor.execute(sql)
+        cursor.execute("INSERT INTO \"user\".schema_migrations (version, description) VALUES (%s, %s)",
+                       (version, description))
+        return True
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.autocommit = False
+
+
+def migrate(conn, target_version=None):
+    """ Applies pending migrations up to target_version (default all), returns the versions applied """
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    applied = []
+
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            done = applied_versions(conn)
+            conn.commit()
+
+            for version, description, sql in MIGRATIONS:
+                if version in done or (target_version is not None and version > target_version):
+                    continue
+
+                logger.info("Applying migration %s: %s", version, description)
+                if isinstance(sql, list):
+                    if apply_statements(conn, cursor, version, description, sql):
+                        applied.append(version)
+                    continue
+
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                # someone else may have got there while we waited for the lock
+                cursor.execute("SELECT 1 FROM \"user\".schema_migrations WHERE version = %s", (version,))
+                if cursor.fetchone():
+                    conn.rollback()
+                    continue
+
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO \"user\".schema_migrations (version, description) VALUES (%s, %s)",
+                               (version, description))
+                conn.commit()
+                applied.append(version)
+        finally:
+            cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+    return applied
+
+
+PRUNE_LOGIN_TOKENS_SQL = "DELETE FROM \"user\".login_tokens WHERE ctid = ANY(ARRAY(" \
+                             "SELECT ctid FROM \"user\".login_tokens " \
+                             "WHERE is_active = false " \
+                             "OR last_checked_timestamp <= %(expired_before)s " \
+                             "LIMIT %(batch_size)s))"
+
+# a signed token past its expiry is rejected anyway, so it no longer needs to be on the denylist
+PRUNE_REVOKED_TOKENS_SQL = "DELETE FROM \"user\".revoked_tokens WHERE ctid = ANY(ARRAY(" \
+                               "SELECT ctid FROM \"user\".revoked_tokens " \
+                               "WHERE expires_timestamp <= %(now)s " \
+                               "LIMIT %(batch_size)s))"
+
+
+# a bucket that has refilled to its burst is the same as no bucket at all
+PRUNE_ADMISSION_BUCKETS_SQL = "DELETE FROM \"user\".admission_buckets WHERE ctid = ANY(ARRAY(" \
+                                  "SELECT ctid FROM \"user\".admission_buckets " \
+                                  "WHERE full_timestamp <= %(now)s " \
+                                  "LIMIT %(batch_size)s))"
+
+
+def prune_login_tokens(conn, token_expiration_days, batch_size=5000, now=None):
+    """ Deletes logged out and expired tokens, and full admission buckets, in batches so no single delete holds locks for long """
+    now = now or datetime.now()
+    parameters = {"expired_before": now - timedelta(days=token_expiration_days), "now": now, "batch_size": batch_size}
+    deleted = 0
+
+    cursor = conn.cursor()
+    try:
+        for sql in (PRUNE_LOGIN_TOKENS_SQL, PRUNE_REVOKED_TOKENS_SQL, PRUNE_ADMISSION_BUCKETS_SQL):
+            while True:
+                cursor.execute(sql, parameters)
+                conn.commit()
+                deleted = deleted + cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+    finally:
+        cursor.close()
+
+    return deleted
+
+
+if __name__ == '__main__':
+    import lambda_function
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    conn = lambda_function.make_conn()
+    try:
+        logger.info("Applied: %s", migrate(conn) or "nothing, already up to date")
+    finally:
+        conn.close()
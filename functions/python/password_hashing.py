@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """ Runs bcrypt on a small thread pool (bcrypt releases the GIL while hashing).
+
+    At most max_workers hashes run at once and at most max_pending more may wait for a
+    worker; anything beyond that waits queue_timeout seconds for room and then gets
+    HashingBusy, so a burst of logins can't pile up unbounded CPU work.
+    """
+
+    def __init__(self, rounds=10, min_rounds=10, max_rounds=16, max_workers=2, max_pending=8,
+                 queue_timeout=1.0):
+        self.rounds = rounds
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.hashes = 0  # bcrypt runs done, and the seconds they took between them
+        self.hash_seconds = 0.0
+        self.stats_lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise HashingBusy("Too many password hashes in progress")
+
+        try:
+            future = self.executor.submit(self.timed, fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self.slots.release())
+        return future.result()
+
+    def timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.stats_lock:
+                self.hashes = self.hashes + 1
+                self.hash_seconds = self.hash_seconds + elapsed
+
+    def mean_hash_seconds(self):
+        with self.stats_lock:
+            return self.hash_seconds / self.hashes if self.hashes else None
+
+    def hash(self, password_b, rounds=None):
+        salt = bcrypt.gensalt(rounds=rounds or self.rounds)
+        return self.run(bcrypt.hashpw, password_b, salt)
+
+    def check(self, password_b, password_encryption):
+        # checkpw does the constant time comparison for us
+        return self.run(bcrypt.checkpw, password_b, password_encryption)
+
+    def needs_rehash(self, password_encryption):
+        return self.cost_of(password_encryption) < self.rounds
+
+    @staticmethod
+    def cost_of(password_encryption):
+        # $2b$<cost>$<salt+hash>
+        try:
+            return int(password_encryption.split(b'$')[2])
+        except (IndexError, ValueError):
+            return 0
+
+    def calibrate(self, target_ms):
+        """ Picks the highest cost whose hash still fits in target_ms on this machine """
+        rounds = self.min_rounds
+        sample = b'calibration password'
+
+        while rounds < self.max_rounds:
+            started = time.perf_counter()
+            bcrypt.hashpw(sample, bcrypt.gensalt(rounds=rounds))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            # every extra round doubles the work
+            if elapsed_ms * 2 > target_ms:
+                break
+            rounds = rounds + 1
+
+        self.rounds = rounds
+        return rounds
@@ -0,0 +1,106 @@
+""" Thin query layer between the handlers and psycopg2.
+
+Fixed handler SQL is wrapped in a Statement and run as a server-side prepared statement, so
+Postgres parses and plans it once per pooled connection instead of once per request. Cursors
+are always closed before returning, and rows come back exactly as the driver produced them.
+"""
+import logging
+import os
+import re
+import weakref
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('SQL_LOG_LEVEL', 'WARNING'))
+
+USE_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', 'true').lower() != 'false'
+
+PLACEHOLDER = re.compile(r'%(?:\((\w+)\))?s')
+
+# connection -> names of the statements already prepared on it
+prepared = weakref.WeakKeyDictionary()
+
+
+class Statement:
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+
+        # %(name)s / %s placeholders become $1..$n for PREPARE, and EXECUTE passes them in that order
+        parameters = []
+
+        def number(match):
+            key = match.group(1)
+            if key is None or key not in parameters:
+                parameters.append(key)
+                return "$%d" % len(parameters)
+            return "$%d" % (parameters.index(key) + 1)
+
+        self.prepare_sql = "PREPARE %s AS %s" % (name, PLACEHOLDER.sub(number, sql))
+        arguments = ", ".join("%s" if key is None else "%%(%s)s" % key for key in parameters)
+        self.execute_sql = "EXECUTE %s (%s)" % (name, arguments) if parameters else "EXECUTE %s" % name
+
+    def __str__(self):
+        return self.sql
+
+
+def run(cursor, statement, parameters):
+    if not isinstance(statement, Statement):
+        logger.debug("Now executing: %s", statement)
+        cursor.execute(statement, parameters)
+        return
+
+    if not USE_PREPARED_STATEMENTS:
+        logger.debug("Now executing: %s", statement.sql)
+        cursor.execute(statement.sql, parameters)
+        return
+
+    names = prepared.setdefault(cursor.connection, set())
+    if statement.name not in names:
+        logger.debug("Preparing: %s", statement.prepare_sql)
+        cursor.execute(statement.prepare_sql)
+        names.add(statement.name)
+
+    logger.debug("Now executing: %s", statement.name)
+    cursor.execute(statement.execute_sql, parameters)
+
+
+def fetch_one(conn, statement, parameters=None):
+    """ First row as a tuple, or None """
+    with conn.cursor() as cursor:
+        run(cursor, statement, parameters)
+        return cursor.fetchone()
+
+
+def fetch_all(conn, statement, parameters=None):
+    with conn.cursor() as cursor:
+        run(cursor, statement, parameters)
+        return cursor.fetchall()
+
+
+def execute(conn, statement, parameters=None):
+    """ Runs a statement for its effect and returns the affected row count """
+    with conn.cursor() as cursor:
+        run(cursor, statement, parameters)
+        return cursor.rowcount
+
+
+@contextmanager
+def transaction(conn):
+    """ Groups several statements into one commit on an autocommit connection.
+
+    Rolls back if the block raises. Inside an enclosing transaction it just joins it.
+    """
+    if not conn.autocommit:
+        yield conn
+        return
+
+    conn.autocommit = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
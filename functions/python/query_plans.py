@@ -0,0 +1,159 @@
+""" Checks with EXPLAIN that every handler query can be answered from an index.
+
+Run from functions/python against a migrated database:
+
+    DB_HOST=localhost DB_NAME=postgres python -m query_plans
+
+Sequential scans are disabled for the check, so a tiny table still reports the plan it would
+get once it's large. That alone would let a walk over a whole index pass, so each index scan also has to have an
+Index Cond on the index's leading column (a partial index may be read whole, its WHERE is the
+condition), and those conditions have to cover the columns each query filters on. Exits
+non-zero on any problem, a sequential scan included, so it can gate a change to a query or
+a migration.
+"""
+import json
+import sys
+from datetime import datetime
+
+import lambda_function
+import migrations
+
+TABLES = ("users", "login_tokens", "revoked_tokens", "admission_buckets")
+INDEX_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+NOW = datetime(2020, 1, 1)
+
+
+def handler_queries():
+    """ (name, sql, parameters, columns) for every statement the handlers run; each column must show up in an
+    Index Cond (or one of them, for a nested tuple), and an empty tuple means no index scan is expected
+    """
+    token = {"user_id": "u", "token": "t"}
+    return [
+        ("user_is_logged_in", lambda_function.IS_LOGGED_IN_SQL,
+         dict(token, last_checked_time=NOW, touch_before=NOW, now=NOW), ("user_id", "token")),
+        ("user_is_logged_in replica", lambda_function.CHECK_TOKEN_SQL, dict(token, last_checked_time=NOW),
+         ("user_id", "token")),
+        ("user_log_in", lambda_function.LOG_IN_SQL, {"email_address": "e"}, ("email_address",)),
+        ("user_log_in rehash", lambda_function.REHASH_PASSWORD_SQL, (b"p", "u"), ("user_id",)),
+        ("user_sign_up exists", lambda_function.EMAIL_EXISTS_SQL, {"email_address": "e"}, ("email_address",)),
+        ("create_token", lambda_function.CREATE_TOKEN_SQL, ("u", "t", NOW, NOW, True), ()),
+        ("user_sign_up", lambda_function.SIGN_UP_SQL,
+         {"user_id": "u", "first_name": "f", "last_name": "l", "email_address": "e", "password_encryption": b"p",
+          "token": "t", "now": NOW}, ()),
+        ("user_log_out", lambda_function.LOG_OUT_SQL, token, ("user_id", "token")),
+        ("sign_up_user", lambda_function.SIGN_UP_USER_SQL,
+         {"user_id": "u", "first_name": "f", "last_name": "l", "email_address": "e", "password_encryption": b"p"},
+         ()),
+        ("revoke_token", lambda_function.REVOKE_TOKEN_SQL, {"token_id": "t", "now": NOW, "expires": NOW}, ()),
+        ("batch_is_logged_in", lambda_function.BATCH_IS_LOGGED_IN_SQL,
+         {"user_ids": ["u", "v"], "tokens": ["t", "t"], "last_checked_time": NOW, "touch_before": NOW, "now": NOW},
+         ("user_id", "token")),
+        ("batch_log_out", lambda_function.BATCH_LOG_OUT_SQL, {"user_ids": ["u", "v"], "tokens": ["t", "t"]}, ("user_id", "token")),
+        ("batch_revoke_tokens", lambda_function.BATCH_REVOKE_TOKENS_SQL,
+         {"token_ids": ["t"], "expires": [NOW], "now": NOW}, ()),
+        ("revoked_since", lambda_function.REVOKED_SINCE_SQL, {"since": NOW, "now": NOW},
+         (("revoked_timestamp", "expires_timestamp"),)),
+        ("prune_login_tokens", migrations.PRUNE_LOGIN_TOKENS_SQL, {"expired_before": NOW, "batch_size": 1},
+         ("last_checked_timestamp",)),
+        ("prune_revoked_tokens", migrations.PRUNE_REVOKED_TOKENS_SQL, {"now": NOW, "batch_size": 1}, ("expires_timestamp",)),
+        ("prune_admission_buckets", migrations.PRUNE_ADMISSION_BUCKETS_SQL, {"now": NOW, "batch_size": 1},
+         ("full_timestamp",)),
+    ]
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        for node in plan_nodes(child):
+            yield node
+
+
+def indexes(conn):
+    """ {index name: (leading column, is partial)} """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT c.relname, a.attname, i.indpred IS NOT NULL FROM pg_index i "
+                       "JOIN pg_class c ON c.oid = i.indexrelid "
+                       "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]")
+        return dict((name, (leading, partial)) for name, leading, partial in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def check_plan(conn, sql, parameters, columns, index_info=None):
+    sql = getattr(sql, 'sql', sql)  # queries.Statement or plain SQL
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, parameters)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    root = plan[0]["Plan"]
+    problems = []
+    nodes = list(plan_nodes(root))
+
+    for node in nodes:
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in TABLES:
+            problems.append("sequential scan on %s" % node["Relation Name"])
+
+    # bitmap index scans only name the index, their heap scan parent names the table
+    index_nodes = [node for node in nodes if node["Node Type"] in INDEX_NODES]
+    conditions = []
+    for node in index_nodes:
+        leading, partial = (index_info or {}).get(node["Index Name"], (None, False))
+        condition = node.get("Index Cond", "")
+        if leading is not None and leading not in condition:
+            # a condition on a later column alone still walks the whole index
+            if not partial:
+                problems.append("whole index %s scanned" % node["Index Name"])
+        else:
+            conditions.append(condition)
+
+    if columns and not index_nodes:
+        problems.append("no index scan")
+    else:
+        for column in columns:
+            # a tuple is alternatives, any one of which will do
+            alternatives = column if isinstance(column, tuple) else (column,)
+            if not any(alternative in condition for condition in conditions for alternative in alternatives):
+                problems.append("no index condition on %s" % " or ".join(alternatives))
+
+    return problems
+
+
+def check_all(conn):
+    """ Returns {query name: [problems]} for every handler query, empty lists meaning all good """
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        results = {}
+        index_info = indexes(conn)
+        for name, sql, parameters, columns in handler_queries():
+            try:
+                results[name] = check_plan(conn, sql, parameters, columns, index_info)
+            except Exception as e:
+                # e.g. ON CONFLICT with no unique index to arbitrate it
+                results[name] = [str(e).strip()]
+            finally:
+                conn.rollback()
+        return results
+    finally:
+        conn.autocommit = autocommit
+
+
+if __name__ == '__main__':
+    conn = lambda_function.make_conn()
+    try:
+        results = check_all(conn)
+    finally:
+        conn.close()
+
+    for name, problems in results.items():
+        print("%-26s %s" % (name, ", ".join(problems) or "ok"))
+
+    sys.exit(1 if any(results.values()) else 0)
@@ -0,0 +1,195 @@
+""" Sends read-only handler queries to read replicas, keeping the primary for writes.
+
+Each replica gets its own ConnectionPool. Reads go to one of them, picked round robin or by
+lowest recent query time, skipping any that errored in the last retry_after_seconds or that
+lag more than max_lag_seconds behind the primary (checked at most every lag_check_seconds).
+With no replica fit to ask, fetch_one returns None and the caller asks the primary.
+
+Replication is asynchronous, which cuts both ways:
+  - a replica can be missing a row the primary already has, e.g. logging in right after
+    signing up, so a replica finding nothing is also answered by asking the primary;
+  - a replica can still have a row the primary has changed, e.g. a token that was just
+    logged out, so keys written through this container go to the primary for a while
+    (see wrote). Elsewhere that staleness is bounded by max_lag_seconds.
+"""
+import itertools
+import logging
+import threading
+import time
+
+from queries import fetch_one
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LATENCY = 'least_latency'
+
+# seconds behind the primary, 0 on a server that isn't replaying WAL (e.g. a second local primary in tests)
+LAG_SQL = "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 " \
+          "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 " \
+          "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+
+# weight of the newest query time in the moving average least_latency compares
+LATENCY_WEIGHT = 0.2
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.latency = None  # moving average of query seconds
+        self.latency_at = None
+        self.lag = None  # seconds, None when unknown
+        self.lag_checked_at = None
+        self.down_until = 0.0
+
+
+class ReplicaSet:
+    def __init__(self, replicas=(), strategy=ROUND_ROBIN, max_lag_seconds=5.0, lag_check_seconds=10.0,
+                 retry_after_seconds=30.0, clock=time.monotonic):
+        if strategy not in (ROUND_ROBIN, LEAST_LATENCY):
+            raise ValueError("Unknown replica strategy %r, expected %s or %s" % (strategy, ROUND_ROBIN, LEAST_LATENCY))
+
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.clock = clock
+
+        self.turn = itertools.count()
+        self.recent_writes = {}  # key -> until when its reads go to the primary
+        self.counts = {'replica': 0, 'missing': 0, 'recent_write': 0, 'no_replica': 0, 'lagging': 0, 'error': 0}
+        self.lock = threading.Lock()
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def wrote(self, key):
+        """ Reads of `key` come from the primary until any replica must have caught up with this write """
+        # a replica's lag was last measured up to lag_check_seconds ago, it may have been at the limit then
+        until = self.clock() + self.max_lag_seconds + self.lag_check_seconds
+        with self.lock:
+            self.recent_writes[key] = until
+            if len(self.recent_writes) > 10000:
+                now = self.clock()
+                self.recent_writes = dict((k, t) for k, t in self.recent_writes.items() if t > now)
+
+    def recently_written(self, key):
+        with self.lock:
+            until = self.recent_writes.get(key)
+            if until is None:
+                return False
+            if until <= self.clock():
+                del self.recent_writes[key]
+                return False
+            return True
+
+    def candidates(self):
+        """ Replicas to try, best first """
+        now = self.clock()
+        usable = [r for r in self.replicas if r.down_until <= now]
+        if not usable:
+            return []
+
+        if self.strategy == LEAST_LATENCY:
+            # an old measurement doesn't count, so a replica that was slow once gets tried again
+            def recent_latency(replica):
+                if replica.latency is None or now - replica.latency_at > self.lag_check_seconds:
+                    return 0.0
+                return replica.latency
+            return sorted(usable, key=recent_latency)
+
+        start = next(self.turn) % len(usable)
+        return usable[start:] + usable[:start]
+
+    def check_lag(self, replica, conn):
+        now = self.clock()
+        if replica.lag_checked_at is not None and now - replica.lag_checked_at < self.lag_check_seconds:
+            return replica.lag
+
+        with conn.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            row = cursor.fetchone()
+        replica.lag = None if row is None or row[0] is None else float(row[0])
+        replica.lag_checked_at = now
+        return replica.lag
+
+    def fetch_one(self, statement, parameters, key=None):
+        """ The first row from a replica, or None when the primary has to be asked instead:
+        nothing found, `key` recently written, or no replica fit to ask.
+        """
+        if not self.replicas:
+            return None
+
+        if key is not None and self.recently_written(key):
+            self.count('recent_write')
+            return None
+
+        for replica in self.candidates():
+            try:
+                conn = replica.pool.get_conn()
+            except Exception:
+                logger.warning("Replica %s unavailable, skipping it for %ss", replica.name, self.retry_after_seconds,
+                               exc_info=True)
+                replica.down_until = self.clock() + self.retry_after_seconds
+                self.count('error')
+                continue
+
+            discard = False
+            try:
+                lag = self.check_lag(replica, conn)
+                if lag is None or lag > self.max_lag_seconds:
+                    self.count('lagging')
+                    continue
+
+                started = time.perf_counter()
+                row = fetch_one(conn, statement, parameters)
+                elapsed = time.perf_counter() - started
+            except Exception:
+                logger.warning("Read on replica %s failed, skipping it for %ss", replica.name, self.retry_after_seconds,
+                               exc_info=True)
+                discard = True
+                replica.down_until = self.clock() + self.retry_after_seconds
+                self.count('error')
+                continue
+            finally:
+                replica.pool.put_conn(conn, discard=discard)
+
+            with self.lock:
+                replica.latency = elapsed if replica.latency is None \
+                    else replica.latency + LATENCY_WEIGHT * (elapsed - replica.latency)
+                replica.latency_at = self.clock()
+
+            if row is None:
+                # maybe not replicated yet
+                self.count('missing')
+                return None
+            self.count('replica')
+            return row
+
+        self.count('no_replica')
+        return None
+
+    def close_all(self):
+        for replica in self.replicas:
+            replica.pool.close_all()
+
+
+def parse_hosts(hosts):
+    """ [(host, port or None)] from "host1,host2:5433,/var/run/postgresql:5434" or a list of those """
+    if isinstance(hosts, str):
+        hosts = hosts.split(',')
+
+    parsed = []
+    for host in hosts or []:
+        host = host.strip()
+        if not host:
+            continue
+        name, colon, port = host.rpartition(':')
+        if colon and port.isdigit():
+            parsed.append((name, int(port)))
+        else:
+            parsed.append((host, None))
+    return parsed
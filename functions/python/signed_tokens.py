@@ -0,0 +1,82 @@
+import calendar
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+
+class SignedTokens:
+    """ Self-contained login tokens: the user id and a token id, signed and timestamped.
+
+    Checking one needs only the secret, no database. Tokens expire max_age_seconds after
+    they were issued.
+    """
+
+    def __init__(self, secret, max_age_seconds, salt='login-token'):
+        self.max_age_seconds = max_age_seconds
+        self.serializer = URLSafeTimedSerializer(secret, salt=salt)
+
+    def issue(self, user_id):
+        return self.serializer.dumps({'u': user_id, 'j': uuid.uuid4().hex})
+
+    def verify(self, user_id, token):
+        """ (token id, seconds left before it expires) for a good token belonging to user_id, else None """
+        try:
+            payload, issued = self.serializer.loads(token, max_age=self.max_age_seconds, return_timestamp=True)
+        except (SignatureExpired, BadSignature):
+            return None
+
+        if not isinstance(payload, dict) or payload.get('u') != user_id:
+            return None
+
+        # utctimetuple works for both the naive UTC datetime of itsdangerous 1.x and the aware one of 2.x
+        age = time.time() - calendar.timegm(issued.utctimetuple())
+        return payload.get('j'), self.max_age_seconds - age
+
+
+class MissingTokenSecret(Exception):
+    pass
+
+
+class Denylist:
+    """ Ids of logged out signed tokens, mirrored from the database.
+
+    load(conn, since) returns (token id, revoked time, expiry) rows revoked after `since` (None
+    for all); it's called at most once per refresh_seconds, so checks in between are pure memory
+    lookups. Each refresh also forgets ids past their expiry, as the token is rejected anyway.
+    """
+
+    def __init__(self, load, refresh_seconds=30, clock=datetime.now):
+        self.load = load
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.token_ids = {}  # 16 byte digest rather than hex string, to keep it compact -> expiry
+        self.loaded_until = None
+        self.next_refresh = 0
+        self.lock = threading.Lock()
+
+    def needs_refresh(self):
+        return time.monotonic() >= self.next_refresh
+
+    def refresh(self, conn):
+        with self.lock:
+            for token_id, revoked, expires in self.load(conn, self.loaded_until):
+                self.token_ids[bytes.fromhex(token_id)] = expires
+                if self.loaded_until is None or revoked > self.loaded_until:
+                    self.loaded_until = revoked
+
+            now = self.clock()
+            self.token_ids = dict((digest, expires) for digest, expires in self.token_ids.items() if expires > now)
+            self.next_refresh = time.monotonic() + self.refresh_seconds
+
+    def add(self, token_id, expires):
+        with self.lock:
+            self.token_ids[bytes.fromhex(token_id)] = expires
+
+    def __contains__(self, token_id):
+        try:
+            return bytes.fromhex(token_id) in self.token_ids
+        except (TypeError, ValueError):
+            return True  # not one of ours, treat as revoked
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """ LRU cache of recently validated (user_id, token) pairs for one Lambda container.
+
+    An entry is trusted for ttl_seconds after the database last confirmed it. Separately it
+    remembers when last_checked_timestamp was written so that write can be debounced to once
+    per touch_interval_seconds.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=60, touch_interval_seconds=300, clock=time.time):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval_seconds = touch_interval_seconds
+        self.clock = clock
+        self.entries = OrderedDict()  # (user_id, token) -> [valid_until, last_touched]
+        self.lock = threading.Lock()
+
+    def is_valid(self, user_id, token):
+        key = (user_id, token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+
+            if entry[0] <= self.clock():
+                del self.entries[key]
+                return False
+
+            self.entries.move_to_end(key)
+            return True
+
+    def needs_touch(self, user_id, token):
+        with self.lock:
+            entry = self.entries.get((user_id, token))
+            return entry is None or self.clock() - entry[1] >= self.touch_interval_seconds
+
+    def remember(self, user_id, token, last_touched=None):
+        now = self.clock()
+        key = (user_id, token)
+        with self.lock:
+            self.entries[key] = [now + self.ttl_seconds, now if last_touched is None else last_touched]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id, token):
+        with self.lock:
+            self.entries.pop((user_id, token), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
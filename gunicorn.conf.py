@@ -0,0 +1,64 @@
+""" gunicorn settings for flaskblog, picked with GUNICORN_PROFILE:
+
+    sync     one request per process, workers = 2 * cpus + 1
+    gthread  (default) a few processes with a pool of threads each, so a slow client only
+             ties up one thread
+    gevent   cooperative workers for many mostly idle connections; gevent isn't in
+             requirements.txt, `pip install -r requirements-gevent.txt` for this one
+
+GUNICORN_WORKERS / GUNICORN_THREADS / GUNICORN_WORKER_CONNECTIONS override the sizing.
+
+    gunicorn -c gunicorn.conf.py flaskblog:app
+"""
+import multiprocessing
+import os
+
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+cpus = multiprocessing.cpu_count()
+
+if profile == 'gevent':
+    # patch before anything else is imported, the app is preloaded into the master
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise ImportError("GUNICORN_PROFILE=gevent needs gevent, pip install -r requirements-gevent.txt")
+    monkey.patch_all()
+
+if profile == 'sync':
+    worker_class = 'sync'
+    default_workers = 2 * cpus + 1
+    default_threads = 1
+elif profile == 'gthread':
+    worker_class = 'gthread'
+    default_workers = cpus + 1
+    default_threads = 4
+elif profile == 'gevent':
+    worker_class = 'gevent'
+    default_workers = cpus + 1
+    default_threads = 1
+else:
+    raise ValueError("Unknown GUNICORN_PROFILE %r, expected sync, gthread or gevent" % profile)
+
+bind = ':' + os.environ.get('PORT', '8080')
+workers = int(os.environ.get('GUNICORN_WORKERS', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', default_threads))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# import the app (and pre-render its page and assets) once in the master, workers share it copy-on-write
+preload_app = True
+
+timeout = 120
+# on SIGTERM / redeploy, in-flight requests get this long to finish
+graceful_timeout = 30
+# the proxy in front reuses connections, don't close them on it between requests
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 75))
+
+# recycle workers now and then, jittered so they don't all restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# worker heartbeats go to a file, keep that off the container's overlay filesystem
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
@@ -0,0 +1,196 @@
+""" Request timing for flaskblog, exposed in the Prometheus text format on /metrics.
+
+Per endpoint: a latency histogram, a response size histogram and request counts by method
+and status, plus the number of requests in flight and template render times (when blinker
+is installed for Flask's signals). Recording is a few dict lookups under one lock.
+
+Each gunicorn worker keeps its own numbers, so a scrape sees the worker that answered it;
+the `pid` label tells them apart.
+
+PROFILE_SAMPLE_RATE (e.g. 0.001) runs that fraction of requests under cProfile, one at a
+time, and writes the stats of those slower than PROFILE_MIN_MS to PROFILE_DIR for pstats
+or snakeviz.
+"""
+import bisect
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response, g, request
+from flask.signals import before_render_template, signals_available, template_rendered
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative = cumulative + count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative)
+        yield '%s_sum{%s} %s' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, app=None, profile_sample_rate=None, profile_min_ms=None, profile_dir=None):
+        self.lock = threading.Lock()
+        self.latency = {}  # endpoint -> Histogram
+        self.size = {}  # endpoint -> Histogram
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.render = {}  # template -> Histogram
+        self.in_flight = 0
+
+        if profile_sample_rate is None:
+            profile_sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_min_ms = float(os.environ.get('PROFILE_MIN_MS', 0)) if profile_min_ms is None else profile_min_ms
+        self.profile_dir = profile_dir or os.environ.get('PROFILE_DIR', '/tmp/flaskblog-profiles')
+        # cProfile only follows the thread that enabled it, and newer Pythons allow one at a time
+        self.profiling = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.add_url_rule('/healthz', 'healthz', self.healthz_view)
+
+        if signals_available:
+            before_render_template.connect(self.before_render, app)
+            template_rendered.connect(self.after_render, app)
+
+    def before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_in_flight = True
+        with self.lock:
+            self.in_flight = self.in_flight + 1
+
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate \
+                and self.profiling.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+
+        endpoint = request.endpoint or 'not_found'
+        # streamed responses have no length yet, count those as 0 rather than buffering them
+        size = response.calculate_content_length() or 0
+
+        with self.lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.size[endpoint] = Histogram(SIZE_BUCKETS)
+            self.latency[endpoint].observe(elapsed)
+            self.size[endpoint].observe(size)
+            key = (endpoint, request.method, response.status_code)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+        self.stop_profiler(endpoint, elapsed)
+        return response
+
+    def teardown_request(self, exc):
+        # runs even when the view raised, so in_flight can't leak
+        if g.pop('metrics_in_flight', False):
+            with self.lock:
+                self.in_flight = self.in_flight - 1
+        self.stop_profiler(request.endpoint or 'not_found', None)
+
+    def stop_profiler(self, endpoint, elapsed):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+
+        profiler.disable()
+        try:
+            if elapsed is not None and elapsed * 1000 >= self.profile_min_ms:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                path = os.path.join(self.profile_dir, '%s-%d-%d.prof' % (endpoint, os.getpid(), time.time() * 1000))
+                profiler.dump_stats(path)
+                logger.info("Profiled %s (%.1f ms) to %s", endpoint, elapsed * 1000, path)
+        except OSError:
+            logger.exception("Couldn't write profile for %s", endpoint)
+        finally:
+            self.profiling.release()
+
+    def before_render(self, sender, template, context, **extra):
+        g.metrics_render_started = time.perf_counter()
+
+    def after_render(self, sender, template, context, **extra):
+        started = g.pop('metrics_render_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if template.name not in self.render:
+                self.render[template.name] = Histogram(LATENCY_BUCKETS)
+            self.render[template.name].observe(elapsed)
+
+    def exposition(self):
+        # read now, not at import: with preload_app the object is created in the gunicorn master
+        pid = 'pid="%d"' % os.getpid()
+        lines = []
+        with self.lock:
+            lines.append('# HELP flask_request_duration_seconds Time from before_request to after_request.')
+            lines.append('# TYPE flask_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines('flask_request_duration_seconds',
+                                             '%s,endpoint="%s"' % (pid, escape(endpoint))))
+
+            lines.append('# HELP flask_response_size_bytes Response body size before compression by a proxy.')
+            lines.append('# TYPE flask_response_size_bytes histogram')
+            for endpoint, histogram in sorted(self.size.items()):
+                lines.extend(histogram.lines('flask_response_size_bytes',
+                                             '%s,endpoint="%s"' % (pid, escape(endpoint))))
+
+            lines.append('# HELP flask_requests_total Finished requests.')
+            lines.append('# TYPE flask_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('flask_requests_total{%s,endpoint="%s",method="%s",status="%d"} %d'
+                             % (pid, escape(endpoint), escape(method), status, count))
+
+            lines.append('# HELP flask_requests_in_flight Requests being handled right now.')
+            lines.append('# TYPE flask_requests_in_flight gauge')
+            lines.append('flask_requests_in_flight{%s} %d' % (pid, self.in_flight))
+
+            lines.append('# HELP flask_template_render_seconds Jinja render time.')
+            lines.append('# TYPE flask_template_render_seconds histogram')
+            for template, histogram in sorted(self.render.items()):
+                lines.extend(histogram.lines('flask_template_render_seconds',
+                                             '%s,template="%s"' % (pid, escape(template))))
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.exposition(), mimetype='text/plain; version=0.0.4')
+
+    def healthz_view(self):
+        return Response('ok\n', mimetype='text/plain', headers={'Cache-Control': 'no-store'})
@@ -0,0 +1,215 @@
+""" Local load generator for flaskblog under each gunicorn profile in gunicorn.conf.py.
+
+Starts gunicorn once per profile, finds the static assets the page links to, then has
+--concurrency keep-alive clients request `/` and those assets for --duration seconds.
+Reports requests per second and p50/p95/p99 latency per path as JSON.
+
+    python loadgen.py --profiles sync gthread --concurrency 16 --duration 10
+    python loadgen.py --slow-clients 4          # plus clients that send half a request and stall
+    python loadgen.py --url http://localhost:8080   # an already running server instead
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+PROFILES = ('sync', 'gthread', 'gevent')
+ASSET_URL = re.compile(r'(?:src|href)="(/static/[^"]+)"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(profile, port, workers=None, threads=None):
+    env = dict(os.environ, GUNICORN_PROFILE=profile, PORT=str(port))
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    if threads:
+        env['GUNICORN_THREADS'] = str(threads)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    # gunicorn 20.0 has no __main__, go through its console script entry point
+    command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()']
+    server = subprocess.Popen(command + ['-c', 'gunicorn.conf.py', 'flaskblog:app'],
+                              cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn (%s) exited: %s" % (profile, server.stderr.read().decode()[-2000:]))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError("gunicorn (%s) didn't start listening on %s" % (profile, port))
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=35)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def discover_paths(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        conn.request('GET', '/')
+        page = conn.getresponse().read().decode('utf-8')
+    finally:
+        conn.close()
+    return ['/'] + sorted(set(ASSET_URL.findall(page)))
+
+
+def stall(host, port, stop):
+    """ A slow client: sends half a request line then keeps the connection open """
+    try:
+        with socket.create_connection((host, port), timeout=5) as s:
+            s.sendall(b'GET / HTTP/1.1\r\n')
+            stop.wait()
+    except OSError:
+        pass
+
+
+def client(host, port, paths, offset, deadline, samples, encoding):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    i = offset
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i = i + 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+        samples.append((path, time.perf_counter() - started, ok))
+    conn.close()
+
+
+def percentile(values, fraction):
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples, wall):
+    latencies = sorted(elapsed * 1000 for path, elapsed, ok in samples)
+    if not latencies:
+        return {'requests': 0}
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for path, elapsed, ok in samples if not ok),
+        'rps': len(samples) / wall,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        },
+    }
+
+
+def run_load(host, port, args):
+    paths = discover_paths(host, port)
+
+    stop = threading.Event()
+    stallers = [threading.Thread(target=stall, args=(host, port, stop), daemon=True)
+                for i in range(args.slow_clients)]
+    for t in stallers:
+        t.start()
+
+    samples = []  # list.append is atomic, the clients can share it
+    deadline = time.monotonic() + args.duration
+    clients = [threading.Thread(target=client, args=(host, port, paths, i, deadline, samples, args.accept_encoding))
+               for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    wall = time.perf_counter() - started
+    stop.set()
+
+    return {
+        'all': summarize(samples, wall),
+        'paths': {path: summarize([s for s in samples if s[0] == path], wall) for path in paths},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='*', default=list(PROFILES), choices=PROFILES)
+    parser.add_argument('--url', help="load an already running server instead of starting gunicorn")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per profile")
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="override the profile's worker count")
+    parser.add_argument('--threads', type=int, help="override the profile's thread count")
+    parser.add_argument('--accept-encoding', default='gzip, br')
+    parser.add_argument('--output', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    if args.url:
+        url = urlsplit(args.url)
+        results[args.url] = run_load(url.hostname, url.port or 80, args)
+    else:
+        for profile in args.profiles:
+            if profile == 'gevent':
+                try:
+                    import gevent  # noqa: F401
+                except ImportError:
+                    results[profile] = {'skipped': "gevent isn't installed"}
+                    continue
+
+            port = free_port()
+            server = start_server(profile, port, args.workers, args.threads)
+            try:
+                results[profile] = run_load('127.0.0.1', port, args)
+            finally:
+                stop_server(server)
+
+    document = {
+        'config': {
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'slow_clients': args.slow_clients,
+            'workers': args.workers,
+            'threads': args.threads,
+            'accept_encoding': args.accept_encoding,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'profiles': results,
+    }
+
+    output = json.dumps(document, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
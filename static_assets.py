@@ -0,0 +1,130 @@
+""" Serves the landing page and everything under static/ from memory.
+
+At startup every static file is read once, hashed and compressed (gzip, plus brotli when the
+module is installed), and templates with no per-request data are rendered once. Requests
+then only pick the variant the client accepts and answer If-None-Match with a 304.
+
+url_for('static', ...) gets a ?v=<hash> argument, so those URLs change whenever the file
+does and can be cached for a year; the page itself is revalidated on every load.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, current_app, render_template, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FINGERPRINTED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# png/jpeg/woff2... are compressed already, gzipping them just costs CPU
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 256
+
+
+class CachedResponse:
+    """ A body prepared once, with its compressed variants and their ETags """
+
+    def __init__(self, data, content_type):
+        self.content_type = content_type
+        self.fingerprint = hashlib.sha256(data).hexdigest()[:12]
+        self.variants = {'identity': data}
+
+        if len(data) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            # only worth keeping if it's meaningfully smaller
+            if len(compressed) < len(data) * 0.9:
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data) * 0.9:
+                    self.variants['br'] = compressed
+
+    def encoding_for(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self, cache_control, accept_ranges=False):
+        # a byte range is served from the plain body, as send_file did
+        if accept_ranges and request.range is not None:
+            encoding = 'identity'
+        else:
+            encoding = self.encoding_for(request.accept_encodings)
+        # the full value, charset included; mimetype= would append a second charset
+        rv = Response(self.variants[encoding], content_type=self.content_type)
+        if encoding != 'identity':
+            rv.headers['Content-Encoding'] = encoding
+        if len(self.variants) > 1:
+            rv.vary.add('Accept-Encoding')
+        # each encoding is a different representation, so it needs its own strong ETag
+        rv.set_etag('%s-%s' % (self.fingerprint, encoding))
+        rv.headers['Cache-Control'] = cache_control
+        if accept_ranges and encoding == 'identity':
+            return rv.make_conditional(request, accept_ranges=True, complete_length=len(self.variants[encoding]))
+        return rv.make_conditional(request)
+
+
+class PrerenderedPage:
+    def __init__(self, template_name, body):
+        self.template_name = template_name
+        self.cached = CachedResponse(body.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def response(self):
+        # keep template edits live while developing
+        if current_app.debug:
+            return render_template(self.template_name)
+        return self.cached.response(REVALIDATE_CACHE_CONTROL)
+
+
+class StaticAssets:
+    def __init__(self, app=None):
+        self.assets = {}  # filename relative to the static folder -> CachedResponse
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.send_static_file = app.view_functions['static']
+        self.load(app.static_folder)
+        app.url_defaults(self.add_fingerprint)
+        app.view_functions['static'] = self.send_asset
+
+    def load(self, static_folder):
+        for root, dirs, files in os.walk(static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                if content_type.startswith('text/'):
+                    content_type = content_type + '; charset=utf-8'
+                with open(path, 'rb') as f:
+                    self.assets[filename] = CachedResponse(f.read(), content_type)
+
+    def add_fingerprint(self, endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            asset = self.assets.get(values.get('filename'))
+            if asset is not None:
+                values['v'] = asset.fingerprint
+
+    def send_asset(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None or current_app.debug:
+            # added after startup, or being edited - let Flask read it from disk
+            return self.send_static_file(filename=filename)
+
+        if request.args.get('v') == asset.fingerprint:
+            return asset.response(FINGERPRINTED_CACHE_CONTROL, accept_ranges=True)
+        return asset.response(REVALIDATE_CACHE_CONTROL, accept_ranges=True)
+
+    def prerender(self, template_name, **context):
+        """ Renders a template that doesn't depend on the request, once """
+        with self.app.test_request_context('/'):
+            return PrerenderedPage(template_name, render_template(template_name, **context))